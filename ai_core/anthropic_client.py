@@ -2,13 +2,13 @@
 import anthropic
 import config # Assuming config.py is in the parent directory or accessible
 import logging
-import json
-import re # Import regex for cleaning
+import hashlib
+from .tool_call_parser import ToolCallStreamParser, strip_tool_calls
 
 logger = logging.getLogger(f"{config.SERVICE_NAME}.AnthropicClient")
 
 class AnthropicClient:
-    def __init__(self, api_key=None, model_name=None):
+    def __init__(self, api_key=None, model_name=None, interrupt_source=None):
         self.api_key = api_key or config.ANTHROPIC_API_KEY
         if not self.api_key:
             logger.error("Anthropic API key is not configured.")
@@ -16,20 +16,93 @@ class AnthropicClient:
         
         self.client = anthropic.Anthropic(api_key=self.api_key)
         self.model_name = model_name or config.DEFAULT_AI_MODEL
-        self.interrupted = False
+        self._interrupt_source = interrupt_source # Shared object with an `interrupted` bool (e.g. the app's InterruptHandler)
+        self._interrupted = False # Own flag, used when there is no shared interrupt_source
+        self.system_prompt_blocks = None # Cached system block list, built once by set_system_prompt()
+        self.system_prompt_hash = None
+        self.last_prompt_tokens = None # Total input tokens the API reported for the latest request, if known
         logger.info(f"AnthropicClient initialized with model: {self.model_name}")
 
+    def set_system_prompt(self, system_prompt: str):
+        """
+        Stores the static system prompt as a cacheable system block.
+        The block carries an ephemeral cache_control marker so Anthropic can serve the
+        prompt prefix from its prompt cache instead of re-processing it every turn.
+        """
+        self.system_prompt_blocks = [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+        self.system_prompt_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+        logger.info(f"System prompt set for caching. Length: {len(system_prompt)} chars, Hash: {self.system_prompt_hash}")
+
+    def warm_connection(self):
+        """
+        Opens the HTTPS connection ahead of the first request, so DNS and TLS setup overlap with the user typing.
+        Uses the token counting endpoint, which is free. Failures are ignored; the first real request just connects itself.
+        """
+        try:
+            self.client.with_options(timeout=10, max_retries=0).messages.count_tokens(
+                model=self.model_name, messages=[{"role": "user", "content": "ping"}])
+            logger.debug("Connection to Anthropic warmed up.")
+        except Exception as e:
+            logger.debug(f"Connection warm-up failed (ignored): {e}")
+
+    @property
+    def interrupted(self):
+        if self._interrupt_source is not None: return self._interrupt_source.interrupted
+        return self._interrupted
+
     def set_interrupted(self, interrupted_status):
-        if self.interrupted != interrupted_status:
+        """Sets the interruption status. Only affects clients without a shared interrupt_source."""
+        if self._interrupted != interrupted_status:
             logger.debug(f"Interruption status set to: {interrupted_status}")
-        self.interrupted = interrupted_status
+        self._interrupted = interrupted_status
 
-    def get_response_stream(self, system_prompt, messages, max_tokens=None):
+    def _move_summaries_to_system(self, system, messages):
         """
-        Yields responses from the Anthropic API using streaming.
-        - Yields ("text_chunk", str_chunk) for text parts.
-        - Yields ("first_tool_call_details", preamble_text, tool_name, tool_args) when the *first* complete 
-          tool call is found. The stream processing for this AI response then stops.
+        Moves leading role "system" messages (conversation summaries) into the system blocks.
+        The Messages API does not accept a "system" role inside messages. The last summary block gets
+        a cache_control breakpoint, so system prompt + summary form a cacheable prefix (at most 2 of the
+        API's 4 breakpoints are used here).
+        """
+        summary_count = 0
+        while summary_count < len(messages) and messages[summary_count].get("role") == "system": summary_count += 1
+        if not summary_count: return system, messages
+        system_blocks = [{"type": "text", "text": system}] if isinstance(system, str) else list(system)
+        system_blocks.extend({"type": "text", "text": m["content"]} for m in messages[:summary_count])
+        system_blocks[-1]["cache_control"] = {"type": "ephemeral"}
+        return system_blocks, messages[summary_count:]
+
+    def _add_history_cache_breakpoint(self, messages):
+        """
+        Returns messages with a cache_control breakpoint on the last message, so the whole conversation
+        prefix can be read from the prompt cache by the next request of the tool loop. The last message is
+        copied into block form; the caller's message dicts are not modified.
+        """
+        if not messages or not isinstance(messages[-1].get("content"), str) or not messages[-1]["content"]: return messages
+        last_message = messages[-1]
+        cached_last = {"role": last_message["role"], "content": [{"type": "text", "text": last_message["content"], "cache_control": {"type": "ephemeral"}}]}
+        return messages[:-1] + [cached_last]
+
+    def _log_prompt_usage(self, usage):
+        """Logs the input token usage reported at message_start, including prompt cache reads and writes, and records the total."""
+        if usage is None: return
+        cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+        cache_written = getattr(usage, "cache_creation_input_tokens", None) or 0
+        self.last_prompt_tokens = usage.input_tokens + cache_read + cache_written
+        logger.info("Prompt tokens: %d uncached, %d read from cache, %d written to cache.", usage.input_tokens, cache_read, cache_written)
+
+    def get_response_stream(self, messages, system_prompt=None, max_tokens=None, model=None):
+        """
+        Yields responses from the Anthropic API using streaming, from `model` (default: the client's model_name).
+        If system_prompt is not given, the cached blocks from set_system_prompt() are used and the conversation
+        prefix gets its own cache breakpoint (system prompt, summary and last message use 3 of the API's 4).
+        Every event is a 3-tuple (event_type, data, extra) so consumers can unpack without a starred target.
+        - Yields ("text_chunk", str_chunk, None) for text parts outside tool calls.
+        - Yields ("tool_call_start", "", None) as soon as an opening <tool_call> tag streams in, then
+          ("tool_args_delta", partial_json, None) for the tool call JSON as it arrives.
+        - Yields ("first_tool_call_details", call_text, (tool_name, tool_args)) when the *first* complete 
+          tool call is found. call_text is the preamble followed by the raw <tool_call> block, i.e. the exact
+          assistant turn to record in history.
+          The stream processing for this AI response then stops.
         - Yields ("stream_complete", full_text_if_no_tool_call, stop_reason) if stream ends 
           without a tool call being actioned.
         - Yields ("error", error_message_str, "error_type_str") on API or processing error.
@@ -41,23 +114,29 @@ class AnthropicClient:
             return
         
         effective_max_tokens = max_tokens if max_tokens is not None else config.MAX_AI_OUTPUT_TOKENS
+        effective_model = model or self.model_name
+        effective_system = system_prompt if system_prompt is not None else self.system_prompt_blocks
         
-        tag_detection_buffer = "" 
         all_text_chunks_this_segment = [] 
-        tool_call_start_tag = "<tool_call>"
-        tool_call_end_tag = "</tool_call>"
+        tool_call_parser = ToolCallStreamParser()
+        self.last_prompt_tokens = None
         
         try:
             if not isinstance(messages, list) or not all(isinstance(m, dict) for m in messages):
                 yield "error", "Invalid messages format.", "internal_error"
                 return
+            if effective_system is None:
+                yield "error", "No system prompt set. Call set_system_prompt() first.", "internal_error"
+                return
+            effective_system, messages = self._move_summaries_to_system(effective_system, messages)
+            if system_prompt is None: messages = self._add_history_cache_breakpoint(messages)
 
-            logger.debug(f"Opening stream to Anthropic. Model: {self.model_name}, Max Tokens: {effective_max_tokens}")
+            logger.debug("Opening stream to Anthropic. Model: %s, Max Tokens: %s", effective_model, effective_max_tokens)
             
             with self.client.messages.stream(
-                model=self.model_name,
+                model=effective_model,
                 max_tokens=effective_max_tokens,
-                system=system_prompt,
+                system=effective_system,
                 messages=messages
             ) as stream:
                 for event in stream:
@@ -67,48 +146,31 @@ class AnthropicClient:
                         stream.close() 
                         return
 
-                    if event.type == "content_block_delta" and event.delta.type == "text_delta":
+                    if event.type == "message_start":
+                        self._log_prompt_usage(event.message.usage)
+                    elif event.type == "content_block_delta" and event.delta.type == "text_delta":
                         text_chunk = event.delta.text
-                        yield "text_chunk", text_chunk 
                         all_text_chunks_this_segment.append(text_chunk)
-                        tag_detection_buffer += text_chunk
-
-                        start_idx = tag_detection_buffer.find(tool_call_start_tag)
-                        if start_idx != -1:
-                            end_idx = tag_detection_buffer.find(tool_call_end_tag, start_idx + len(tool_call_start_tag))
-                            if end_idx != -1:
-                                tool_json_str = tag_detection_buffer[start_idx + len(tool_call_start_tag) : end_idx]
-                                try:
-                                    tool_data = json.loads(tool_json_str)
-                                    tool_name = tool_data.get("tool_name")
-                                    tool_args = tool_data.get("arguments")
-
-                                    if tool_name and isinstance(tool_args, dict):
-                                        logger.info(f"First tool call detected and parsed: {tool_name}")
-                                        preamble_text = "".join(all_text_chunks_this_segment).split(tool_call_start_tag)[0].strip()
-                                        yield "first_tool_call_details", preamble_text, tool_name, tool_args
-                                        stream.close() 
-                                        return 
-                                    else:
-                                        logger.warning(f"Malformed tool JSON (parsed but invalid structure): {tool_json_str}")
-                                except json.JSONDecodeError as e:
-                                    logger.warning(f"JSONDecodeError in tool call: {e}. Content: {tool_json_str}")
-                                # If tool call was malformed or unparsable, it's treated as text.
-                                # Advance buffer past this point to avoid re-parsing the same invalid block.
-                                tag_detection_buffer = tag_detection_buffer[end_idx + len(tool_call_end_tag):]
+                        for parsed_event in tool_call_parser.feed(text_chunk):
+                            yield parsed_event
+                            if parsed_event[0] == "first_tool_call_details":
+                                stream.close() 
+                                return 
                     elif event.type == "message_stop":
+                        yield from tool_call_parser.flush()
                         final_message = stream.get_final_message()
                         final_stop_reason = final_message.stop_reason if final_message else "unknown_stop"
                         full_text = "".join(all_text_chunks_this_segment)
-                        logger.info(f"Stream ended by API (message_stop). Stop Reason: {final_stop_reason}. Full text length: {len(full_text)}")
+                        logger.info("Stream ended by API (message_stop). Stop Reason: %s. Full text length: %d", final_stop_reason, len(full_text))
                         yield "stream_complete", full_text, final_stop_reason
                         return
             
                 # Fallback if loop finishes (e.g. stream closed by interrupt before message_stop)
+                yield from tool_call_parser.flush()
                 final_message_obj_fallback = stream.get_final_message()
                 final_stop_reason_fallback = final_message_obj_fallback.stop_reason if final_message_obj_fallback else "ended_unexpectedly"
                 full_text_fallback = "".join(all_text_chunks_this_segment)
-                logger.info(f"Stream loop exited. Final text: '{full_text_fallback[:100]}...'. Fallback Stop Reason: {final_stop_reason_fallback}")
+                logger.info("Stream loop exited. Final text: '%.100s...'. Fallback Stop Reason: %s", full_text_fallback, final_stop_reason_fallback)
                 yield "stream_complete", full_text_fallback, final_stop_reason_fallback
 
         except Exception as e:
@@ -116,6 +178,60 @@ class AnthropicClient:
             logger.error(f"Error during Anthropic stream ({error_type}): {e}", exc_info=True)
             yield "error", f"Stream error ({error_type}): {e}", error_type
 
+    def create_message_batch(self, prompts: list[tuple[str, list[dict]]], max_tokens=None) -> str | None:
+        """
+        Submits conversation requests through the Message Batches API (half the token price of interactive
+        requests, results within 24 hours). Uses the cached system prompt from set_system_prompt().
+        Args:
+            prompts (list[tuple[str, list[dict]]]): (custom_id, messages) pairs, one per request.
+            max_tokens (int, optional): Output token limit per request. Defaults to MAX_AI_OUTPUT_TOKENS.
+        Returns:
+            str | None: The batch id, or None if the batch could not be created.
+        """
+        if self.system_prompt_blocks is None:
+            logger.error("No system prompt set. Call set_system_prompt() first."); return None
+        requests = []
+        for custom_id, messages in prompts:
+            system, messages = self._move_summaries_to_system(self.system_prompt_blocks, messages)
+            requests.append({"custom_id": custom_id, "params": {
+                "model": self.model_name, "max_tokens": max_tokens or config.MAX_AI_OUTPUT_TOKENS,
+                "system": system, "messages": messages}})
+        try:
+            batch = self.client.messages.batches.create(requests=requests)
+        except anthropic.APIError as e:
+            logger.error(f"Failed to create message batch: {e}", exc_info=True)
+            return None
+        logger.info(f"Message batch {batch.id} created with {len(requests)} requests.")
+        return batch.id
+
+    def get_message_batch_results(self, batch_id: str) -> dict[str, str] | None:
+        """
+        Returns {custom_id: response_text} once the batch has ended, or None while it is still processing.
+        Tool calls are not executed for batched requests, so they are removed from the returned text.
+        Requests that did not succeed are left out; an API error returns an empty dict.
+        """
+        try:
+            batch = self.client.messages.batches.retrieve(batch_id)
+            if batch.processing_status != "ended": return None
+            results = {}
+            for entry in self.client.messages.batches.results(batch_id):
+                if entry.result.type != "succeeded":
+                    logger.warning(f"Batch request {entry.custom_id} did not succeed: {entry.result.type}"); continue
+                text = "".join(block.text for block in entry.result.message.content if block.type == "text")
+                results[entry.custom_id] = strip_tool_calls(text).strip()
+            logger.info(f"Message batch {batch_id} ended. {len(results)} successful results.")
+            return results
+        except anthropic.APIError as e:
+            logger.error(f"Failed to retrieve message batch {batch_id}: {e}", exc_info=True)
+            return {}
+
+    def cancel_message_batch(self, batch_id: str):
+        try:
+            self.client.messages.batches.cancel(batch_id)
+            logger.info(f"Message batch {batch_id} cancelled.")
+        except anthropic.APIError as e:
+            logger.error(f"Failed to cancel message batch {batch_id}: {e}")
+
     def summarize_conversation(self, conversation_history: list[dict], target_token_count: int) -> str | None:
         if self.interrupted: logger.info("Summarization interrupted."); return None
         if not conversation_history: logger.info("No history to summarize."); return None
@@ -135,42 +251,36 @@ class AnthropicClient:
         if max_summary_tokens > 4096: max_summary_tokens = 4096 
         if target_token_count > 4096 : max_summary_tokens = int(target_token_count * 1.2)
         
-        logger.info(f"Requesting summarization. Max summary tokens: {max_summary_tokens}")
+        logger.info(f"Requesting summarization from {config.SUMMARY_AI_MODEL}. Max summary tokens: {max_summary_tokens}")
+        # The range usually ends on an assistant turn (the kept tail starts on a user turn). A trailing assistant
+        # message would be treated as a prefill and continued, so the request always ends on this user instruction.
+        summary_request = [*conversation_history, {"role": "user", "content": "Summarize the conversation above as instructed. Output only the summary text."}]
         
         accumulated_summary_text_chunks = []
         final_reason_for_summary = "error" 
         tool_call_was_detected_in_summary = False
 
-        for event_type, data, *extra in self.get_response_stream(
+        for event_type, data, extra in self.get_response_stream(
             system_prompt=summarization_system_prompt,
-            messages=conversation_history,
-            max_tokens=max_summary_tokens
+            messages=summary_request,
+            max_tokens=max_summary_tokens,
+            model=config.SUMMARY_AI_MODEL
         ):
             if event_type == "text_chunk":
                 accumulated_summary_text_chunks.append(data)
             elif event_type == "first_tool_call_details": 
-                preamble_before_tool, tool_name, tool_args = data, extra[0], extra[1]
-                logger.warning(f"Tool call ('{tool_name}') detected during summarization within text: '{preamble_before_tool}'. This is invalid for a summary.")
-                # Also append the preamble text that came before the invalid tool call
-                if preamble_before_tool:
-                    accumulated_summary_text_chunks.append(preamble_before_tool)
-                # And append the problematic tool call itself as text so it can be cleaned
-                malformed_tool_text = f"<tool_call>{json.dumps({'tool_name': tool_name, 'arguments': tool_args})}</tool_call>"
-                accumulated_summary_text_chunks.append(malformed_tool_text)
+                tool_name = extra[0]
+                logger.warning(f"Tool call ('{tool_name}') detected during summarization within text: '{data}'. This is invalid for a summary.")
+                # data is the text streamed up to and including the tool call; it replaces the chunks
+                # accumulated so far, and the tool call tags are cleaned out below.
+                accumulated_summary_text_chunks = [data]
                 tool_call_was_detected_in_summary = True
-                # Don't break; let the stream finish to capture any text *after* the bad tool call.
-                # The client side `get_response_stream` already stops after the first tool call.
-                # This means the stream will end shortly after this event if the client worked as intended.
-                # However, the client is designed to yield `first_tool_call_details` and then `return`.
-                # This logic here might need to align with how `get_response_stream` behaves when it yields `first_tool_call_details`.
-                # If `get_response_stream` truly stops and returns, this loop will break.
-                # For now, let's assume the stream might continue and we clean up later.
-                # The current `get_response_stream` *does* return after yielding `first_tool_call_details`.
-                # So, this loop will break after this event.
+                # The client side `get_response_stream` returns after yielding `first_tool_call_details`,
+                # so this loop ends with this event.
                 final_reason_for_summary = "tool_call_in_summary_attempt"
                 break 
             elif event_type == "stream_complete":
-                final_reason_for_summary = extra[0] if extra else "unknown_end"
+                final_reason_for_summary = extra or "unknown_end"
                 if data: # data is the full text from client's buffer
                     accumulated_summary_text_chunks = [data] # Prefer this complete text
                 break
@@ -183,8 +293,8 @@ class AnthropicClient:
         if tool_call_was_detected_in_summary or \
            ("<tool_call>" in full_summary_text or "</tool_call>" in full_summary_text):
             logger.warning(f"Tool call tags were present in the AI's summary attempt. Original text: '{full_summary_text[:300]}...'")
-            # Failsafe: Remove tool calls using regex
-            cleaned_summary_text = re.sub(r"<tool_call>.*?</tool_call>", "", full_summary_text, flags=re.DOTALL).strip()
+            # Failsafe: Remove tool call blocks
+            cleaned_summary_text = strip_tool_calls(full_summary_text).strip()
             
             if not cleaned_summary_text:
                 logger.error("Summary is empty after removing tool calls.")
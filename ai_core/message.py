@@ -0,0 +1,24 @@
+# ai_core/message.py
+
+class Msg:
+    """
+    One conversation history entry. Uses __slots__ instead of a per-message dict, which keeps
+    long histories smaller and attribute access cheap. Messages are converted to API dicts
+    with to_dict() only when a request is built.
+    """
+    __slots__ = ("role", "content")
+
+    def __init__(self, role: str, content):
+        self.role = role
+        self.content = content # str, or a list of content blocks
+
+    def to_dict(self) -> dict:
+        """Returns the message in the {"role": ..., "content": ...} form the API expects."""
+        return {"role": self.role, "content": self.content}
+
+    def __eq__(self, other):
+        if not isinstance(other, Msg): return NotImplemented
+        return self.role == other.role and self.content == other.content
+
+    def __repr__(self):
+        return f"Msg(role={self.role!r}, content={self.content!r})"
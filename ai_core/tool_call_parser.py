@@ -0,0 +1,143 @@
+# ai_core/tool_call_parser.py
+import json
+import logging
+import sys
+
+import config
+
+# Optional faster JSON parsers for tool call payloads, in order of preference. All of them raise a
+# ValueError subclass on malformed input.
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+        _json_loads = ujson.loads
+    except ImportError:
+        _json_loads = json.loads
+
+logger = logging.getLogger(f"{config.SERVICE_NAME}.ToolCallParser")
+
+TOOL_CALL_START_TAG = "<tool_call>"
+TOOL_CALL_END_TAG = "</tool_call>"
+
+def _partial_tag_length(text: str, tag: str) -> int:
+    """Returns the length of the longest suffix of text that is a proper prefix of tag."""
+    for n in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:n]):
+            return n
+    return 0
+
+def strip_tool_calls(text: str) -> str:
+    """Removes complete <tool_call>...</tool_call> blocks from text. Unclosed tags are left as they are."""
+    if TOOL_CALL_START_TAG not in text: return text # Common case: plain text, returned without a copy
+    parts = text.split(TOOL_CALL_START_TAG)
+    kept = [parts[0]]
+    for part in parts[1:]:
+        _, end_tag, tail = part.partition(TOOL_CALL_END_TAG)
+        kept.append(tail if end_tag else TOOL_CALL_START_TAG + part)
+    return "".join(kept)
+
+class ToolCallStreamParser:
+    """
+    Incrementally splits streamed AI text into plain text and <tool_call> blocks.
+    feed() returns the events for one chunk, using the same 3-tuple protocol as
+    AnthropicClient.get_response_stream:
+    - ("text_chunk", text, None) for text outside tool calls. A trailing partial tag is held back
+      until the next chunk shows whether it really starts a tool call.
+    - ("tool_call_start", "", None) as soon as an opening <tool_call> tag is seen.
+    - ("tool_args_delta", partial_json, None) for tool call JSON as it arrives.
+    - ("first_tool_call_details", call_text, (tool_name, tool_args)) once a complete,
+      valid tool call has been parsed. call_text is the preamble plus the raw tool call block.
+    A malformed tool call is re-emitted as a text_chunk containing the raw block.
+    """
+    def __init__(self):
+        self.pending = "" # Received text that has not been emitted yet
+        self.in_tool_call = False
+        self.text_parts = [] # Text emitted so far (the preamble of a later tool call)
+        self.tool_json_parts = []
+
+    def _emit_text(self, text: str, events: list):
+        if text:
+            self.text_parts.append(text)
+            events.append(("text_chunk", text, None))
+
+    def _finish_tool_call(self, tool_json_str: str, events: list) -> bool:
+        """Parses a complete tool call block. Returns True if a valid tool call event was emitted."""
+        stripped_json = tool_json_str.strip()
+        if not (stripped_json.startswith("{") and stripped_json.endswith("}") and '"tool_name"' in stripped_json):
+            # Cheap pre-check: obviously not a tool call object, so skip the JSON parser (and its exception).
+            logger.warning("Malformed tool call (not a JSON object with a tool_name): %s", tool_json_str)
+            self._emit_text(f"{TOOL_CALL_START_TAG}{tool_json_str}{TOOL_CALL_END_TAG}", events)
+            return False
+        try:
+            tool_data = _json_loads(tool_json_str)
+            tool_name = tool_data.get("tool_name") if isinstance(tool_data, dict) else None
+            tool_args = tool_data.get("arguments") if isinstance(tool_data, dict) else None
+            if tool_name and isinstance(tool_name, str) and isinstance(tool_args, dict):
+                tool_name = sys.intern(tool_name) # Tool/prefix dict lookups then match the registered key by identity
+                logger.info("First tool call detected and parsed: %s", tool_name)
+                preamble_text = "".join(self.text_parts).strip()
+                call_text = f"{preamble_text}\n{TOOL_CALL_START_TAG}{tool_json_str}{TOOL_CALL_END_TAG}".lstrip()
+                events.append(("first_tool_call_details", call_text, (tool_name, tool_args)))
+                return True
+            logger.warning("Malformed tool JSON (parsed but invalid structure): %s", tool_json_str)
+        except ValueError as e: # json.JSONDecodeError, orjson.JSONDecodeError or ujson's ValueError
+            logger.warning("JSON decode error in tool call: %s. Content: %s", e, tool_json_str)
+        # If tool call was malformed or unparsable, it's treated as text.
+        self._emit_text(f"{TOOL_CALL_START_TAG}{tool_json_str}{TOOL_CALL_END_TAG}", events)
+        return False
+
+    def feed(self, chunk: str) -> list:
+        """Consumes one streamed text chunk and returns the resulting events."""
+        if not self.in_tool_call and not self.pending and "<" not in chunk:
+            # Fast path for plain text (the common case): nothing held back and no tag can start in this chunk.
+            if not chunk: return []
+            self.text_parts.append(chunk)
+            return [("text_chunk", chunk, None)]
+        events = []
+        self.pending += chunk
+        while self.pending:
+            if not self.in_tool_call:
+                start_idx = self.pending.find(TOOL_CALL_START_TAG)
+                if start_idx == -1:
+                    hold = _partial_tag_length(self.pending, TOOL_CALL_START_TAG)
+                    self._emit_text(self.pending[:len(self.pending) - hold], events)
+                    self.pending = self.pending[len(self.pending) - hold:]
+                    break
+                self._emit_text(self.pending[:start_idx], events)
+                self.pending = self.pending[start_idx + len(TOOL_CALL_START_TAG):]
+                self.in_tool_call = True
+                events.append(("tool_call_start", "", None))
+            else:
+                end_idx = self.pending.find(TOOL_CALL_END_TAG)
+                if end_idx == -1:
+                    hold = _partial_tag_length(self.pending, TOOL_CALL_END_TAG)
+                    json_delta = self.pending[:len(self.pending) - hold]
+                    self.pending = self.pending[len(self.pending) - hold:]
+                    if json_delta:
+                        self.tool_json_parts.append(json_delta)
+                        events.append(("tool_args_delta", json_delta, None))
+                    break
+                json_delta = self.pending[:end_idx]
+                self.pending = self.pending[end_idx + len(TOOL_CALL_END_TAG):]
+                if json_delta:
+                    self.tool_json_parts.append(json_delta)
+                    events.append(("tool_args_delta", json_delta, None))
+                tool_json_str = "".join(self.tool_json_parts)
+                self.in_tool_call, self.tool_json_parts = False, []
+                if self._finish_tool_call(tool_json_str, events):
+                    break # Only the first valid tool call of a response is actioned
+        return events
+
+    def flush(self) -> list:
+        """Emits whatever is still held back at the end of the stream (e.g. an unclosed tool call) as text."""
+        events = []
+        leftover = self.pending
+        if self.in_tool_call:
+            leftover = TOOL_CALL_START_TAG + "".join(self.tool_json_parts) + leftover
+            logger.warning("Stream ended inside an unclosed tool call; treating it as text.")
+        self.pending, self.in_tool_call, self.tool_json_parts = "", False, []
+        self._emit_text(leftover, events)
+        return events
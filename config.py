@@ -16,16 +16,36 @@ BRAVE_SEARCH_API_KEY = os.getenv("BRAVE_SEARCH_API_KEY")
 # --- AI Configuration ---
 DEFAULT_AI_MODEL = os.getenv("DEFAULT_AI_MODEL", "claude-sonnet-4-20250514") # Or claude-3-sonnet-20240229 for faster/cheaper testing
 MAX_AI_OUTPUT_TOKENS = int(os.getenv("MAX_AI_OUTPUT_TOKENS", 64000)) # User requested, default 2048
+SUMMARY_AI_MODEL = os.getenv("SUMMARY_AI_MODEL") or DEFAULT_AI_MODEL # Model for history summaries; a smaller one is usually enough
+
+# Message Batches API settings ("#batch <prompt>" input)
+BATCH_QUEUE_SIZE = int(os.getenv("BATCH_QUEUE_SIZE", 5)) # Queued batch prompts are sent automatically at this count
+BATCH_POLL_SECONDS = int(os.getenv("BATCH_POLL_SECONDS", 5)) # First wait between batch status checks; doubles each time
+BATCH_POLL_MAX_SECONDS = int(os.getenv("BATCH_POLL_MAX_SECONDS", 60))
 
 # Context summarization settings
 CONTEXT_TOKEN_HARD_LIMIT = int(os.getenv("CONTEXT_TOKEN_HARD_LIMIT", 180000)) # e.g. Claude 3 Opus has 200k context
 CONTEXT_TOKEN_SOFT_LIMIT = int(os.getenv("CONTEXT_TOKEN_SOFT_LIMIT", 150000)) # Trigger summarization earlier
 SUMMARIZED_HISTORY_TARGET_TOKENS = int(os.getenv("SUMMARIZED_HISTORY_TARGET_TOKENS", 20000))
 MIN_MESSAGES_TO_KEEP_BEFORE_SUMMARY = int(os.getenv("MIN_MESSAGES_TO_KEEP_BEFORE_SUMMARY", 6)) # Keep last 3 user/assistant turns
+SUMMARIZED_HISTORY_TAIL_TOKENS = int(os.getenv("SUMMARIZED_HISTORY_TAIL_TOKENS", 8000)) # Newest messages kept verbatim (by tokens) when summarizing
+TOKEN_CHECK_DELTA = int(os.getenv("TOKEN_CHECK_DELTA", 500)) # Re-check context size only after history grew by this many tokens
+SLIDING_WINDOW_TRIM_ENABLED = os.getenv("SLIDING_WINDOW_TRIM_ENABLED", "False").lower() == "true" # Drop old plain messages before paying for a summary
 
 # --- Tool Configuration ---
 DEFAULT_COMMAND_TIMEOUT = int(os.getenv("DEFAULT_COMMAND_TIMEOUT", 300)) # 5 minutes
 REQUIRE_COMMAND_CONFIRMATION = os.getenv("REQUIRE_COMMAND_CONFIRMATION", "True").lower() == "true"
+TOOL_EXECUTION_TIMEOUT = int(os.getenv("TOOL_EXECUTION_TIMEOUT", 60)) # Seconds before a tool call is abandoned (tools can override)
+TOOL_OUTPUT_SOFT_LIMIT = int(os.getenv("TOOL_OUTPUT_SOFT_LIMIT", 8000)) # Tool outputs longer than this (chars) are compacted in history
+TOOL_OUTPUT_KEEP_CHARS = int(os.getenv("TOOL_OUTPUT_KEEP_CHARS", 2000)) # Chars kept from both the head and the tail of a compacted output
+TOOL_CACHE_DIR = os.getenv("TOOL_CACHE_DIR", os.path.join(os.getenv("XDG_CACHE_HOME") or "~/.cache", "kali_ai_tool")) # Per-user dir for search results reused across sessions; empty keeps them in memory only
+WEB_SEARCH_CACHE_TTL = int(os.getenv("WEB_SEARCH_CACHE_TTL", 14400)) # Seconds a web_search result is reused for the same arguments (0 disables)
+CVE_SEARCH_CACHE_TTL = int(os.getenv("CVE_SEARCH_CACHE_TTL", 86400)) # Same for cve_search
+
+
+# --- Input Configuration ---
+INPUT_HISTORY_FILE = os.getenv("INPUT_HISTORY_FILE", "~/.kali_ai_history") # Readline history file; empty disables persistence
+INPUT_HISTORY_LENGTH = int(os.getenv("INPUT_HISTORY_LENGTH", 1000)) # Max lines kept in the history file
 
 
 # --- Logging Configuration ---
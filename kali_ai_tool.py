@@ -1,21 +1,36 @@
 # kali_ai_tool.py
+import argparse
+import atexit
+import hashlib
+import importlib
+import io
 import json
-import readline
+import os
 import sys
 import logging
 import time
-# import re # No longer needed
+import itertools
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeout
+import re
+import select
+import threading
+from collections import deque
 
 import config
-from ai_core.anthropic_client import AnthropicClient
-from tools.base_tool import BaseTool
-from tools.command_line_tool import CommandLineTool
-from tools.web_search_tool import WebSearchTool
-from tools.cve_search_tool import CVESearchTool
-from tools.wait_tool import WaitTool
+from tools.base_tool import BaseTool, ToolResult
+from ai_core.message import Msg
 from utils.interrupt_handler import InterruptHandler
 from utils.logger_setup import setup_logging
-from utils.token_estimator import estimate_messages_token_count
+from utils.token_estimator import CHARS_PER_TOKEN_ESTIMATE, estimate_message_token_count, estimate_token_count
+from utils.tool_cache import ToolCache
+
+try: # Optional faster JSON serializer for tool argument previews
+    import orjson
+except ImportError:
+    orjson = None
+
+if sys.stdin.isatty(): import readline # Line editing/history for input(); skipped for piped stdin
+else: readline = None
 
 logger = setup_logging(
     log_file_path=config.LOG_FILE_PATH,
@@ -25,110 +40,576 @@ logger = setup_logging(
 )
 
 # --- Initial Setup ---
-try:
-    with open("system_prompt.txt", "r") as f: SYSTEM_PROMPT = f.read()
-    logger.info("System prompt loaded successfully.")
-except FileNotFoundError:
-    print("CRITICAL: system_prompt.txt not found.", file=sys.stderr); sys.exit(1)
-try:
-    ai_client = AnthropicClient()
-    logger.info(f"AnthropicClient initialized with model: {ai_client.model_name}")
-except ValueError as e: 
-    print(f"CRITICAL: AI Client Error: {e}", file=sys.stderr); sys.exit(1)
-except Exception as e:
-    print(f"CRITICAL: Unexpected error initializing AI Client: {e}", file=sys.stderr)
-    logger.critical(f"CRITICAL: Unexpected error initializing AI Client: {e}", exc_info=True)
-    sys.exit(1)
-
-available_tools: dict[str, BaseTool] = {
-    "command_line": CommandLineTool(), "web_search": WebSearchTool(),
-    "cve_search": CVESearchTool(), "wait": WaitTool(),
+# Set by initialize_app(), which main() and main_batch() call after argument parsing, so e.g. --help
+# needs no API key, system prompt file or cache directory.
+SYSTEM_PROMPT = ""
+interrupt_handler: InterruptHandler | None = None
+_tool_cache: ToolCache | None = None # Results of tools with a cache_ttl (web/CVE searches), reused within and across sessions
+
+def initialize_app():
+    """Loads the system prompt, checks the API key and sets up input history, Ctrl+C handling and the tool cache. Runs once."""
+    global SYSTEM_PROMPT, interrupt_handler, _tool_cache
+    if interrupt_handler is not None: return
+    if readline is not None and config.INPUT_HISTORY_FILE:
+        # Persist input history across sessions: read once here, written once at exit.
+        history_path = os.path.expanduser(config.INPUT_HISTORY_FILE)
+        try: readline.read_history_file(history_path)
+        except (FileNotFoundError, OSError): pass
+        readline.set_history_length(config.INPUT_HISTORY_LENGTH)
+        atexit.register(readline.write_history_file, history_path)
+    try:
+        with open("system_prompt.txt", "r", encoding="utf-8") as f: SYSTEM_PROMPT = f.read()
+        logger.info("System prompt loaded successfully.")
+    except FileNotFoundError:
+        print("CRITICAL: system_prompt.txt not found.", file=sys.stderr); sys.exit(1)
+    if not config.ANTHROPIC_API_KEY: # Checked up front; the client itself is created in the background (see get_ai_client)
+        print("CRITICAL: AI Client Error: Anthropic API key is not configured. Please set ANTHROPIC_API_KEY in your .env file.", file=sys.stderr); sys.exit(1)
+    _tool_cache = ToolCache(config.TOOL_CACHE_DIR)
+    interrupt_handler = InterruptHandler()
+    logger.info("InterruptHandler initialized.")
+
+# Tool name -> (module, class). Tool modules (and their dependencies, e.g. requests) are imported and
+# instantiated on first use by get_tool(); available_tools only holds the instances created so far.
+_TOOL_SPECS = {
+    "command_line": ("tools.command_line_tool", "CommandLineTool"), "web_search": ("tools.web_search_tool", "WebSearchTool"),
+    "cve_search": ("tools.cve_search_tool", "CVESearchTool"), "wait": ("tools.wait_tool", "WaitTool"),
 }
-logger.info(f"Available tools initialized: {list(available_tools.keys())}")
-interrupt_handler = InterruptHandler()
-logger.info("InterruptHandler initialized.")
-conversation_history = []
+available_tools: dict[str, BaseTool] = {}
+logger.info(f"Available tools registered: {list(_TOOL_SPECS.keys())}")
+# Context management (which may request a summary) runs on its own single worker while a tool executes,
+# so it can never queue behind tool calls.
+_CONTEXT_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context")
+
+def run_in_background(fn, *args, name: str) -> Future:
+    """
+    Runs fn(*args) on a new daemon thread and returns a Future for its result.
+    Used for tool calls and client start-up: every call starts right away instead of queueing behind
+    a hung one, a call abandoned after a timeout never runs later, and none of them delays exit.
+    """
+    future = Future()
+    def runner():
+        if not future.set_running_or_notify_cancel(): return
+        try: future.set_result(fn(*args))
+        except BaseException as e: future.set_exception(e)
+    threading.Thread(target=runner, name=name, daemon=True).start()
+    return future
+
+def create_ai_client():
+    """Imports and creates the AnthropicClient. Importing anthropic/httpx is the slowest part of startup."""
+    from ai_core.anthropic_client import AnthropicClient
+    client = AnthropicClient(interrupt_source=interrupt_handler)
+    client.set_system_prompt(SYSTEM_PROMPT)
+    get_system_prompt_tokens() # Estimated here, off the main thread: the first estimate may load the tiktoken encoding
+    logger.info(f"AnthropicClient initialized with model: {client.model_name}")
+    run_in_background(client.warm_connection, name="warm-up") # Not waited for: the first request must not queue behind it
+    return client
+
+# The client is built in the background while the first prompt is being typed; get_ai_client() waits for it.
+# Started by start_ai_client_init() once argument parsing and the early-exit paths are done.
+_ai_client = None
+_ai_client_future: Future | None = None
+
+# Token estimate of SYSTEM_PROMPT (see get_system_prompt_tokens).
+_system_prompt_tokens: int | None = None
+
+def get_system_prompt_tokens() -> int:
+    """
+    Token estimate of the system prompt, which is sent with every request and so counts against the context
+    limits. Computed once; normally by create_ai_client on its background thread, otherwise on first use.
+    """
+    global _system_prompt_tokens
+    if _system_prompt_tokens is None: _system_prompt_tokens = estimate_token_count(SYSTEM_PROMPT)
+    return _system_prompt_tokens
+
+def start_ai_client_init():
+    global _ai_client_future
+    if _ai_client_future is None:
+        initialize_app() # The client needs the system prompt and the interrupt handler
+        _ai_client_future = run_in_background(create_ai_client, name="client-init")
+
+def get_ai_client():
+    global _ai_client
+    if _ai_client is None:
+        start_ai_client_init() # No-op unless nothing has started it yet
+        try:
+            _ai_client = _ai_client_future.result()
+        except ValueError as e: 
+            print(f"CRITICAL: AI Client Error: {e}", file=sys.stderr); sys.exit(1)
+        except Exception as e:
+            print(f"CRITICAL: Unexpected error initializing AI Client: {e}", file=sys.stderr)
+            logger.critical(f"CRITICAL: Unexpected error initializing AI Client: {e}", exc_info=True)
+            sys.exit(1)
+    return _ai_client
+
+conversation_history: deque[Msg] = deque() # Deque so summarization/trimming can evict the oldest messages in place
+
+_EXIT_COMMANDS = frozenset(("exit", "quit"))
+# "#batch <prompt>" queues a prompt for the Message Batches API; "#flush" sends the queue right away.
+_BATCH_PREFIX, _FLUSH_COMMAND = "#batch ", "#flush"
+_batch_queue: list[str] = []
+_COMPLETION_WORDS = ("exit", "quit", _BATCH_PREFIX.strip(), _FLUSH_COMMAND)
+# Lines read ahead by read_user_input() that start a new turn of their own (e.g. a command after a paste).
+_pending_input: deque[str] = deque()
+
+# Running token estimate for conversation_history, updated on every append/eviction.
+_running_tokens = 0
+# Ratio of the prompt size the API reported for the last request to our estimate of it (clamped to
+# _TOKEN_SCALE_RANGE). The context limits are divided by it, which corrects the estimator for this
+# session's content without any extra token counting requests.
+_token_scale = 1.0
+_TOKEN_SCALE_RANGE = (0.5, 2.0)
+# History length and token estimate at the last context check. Context management is skipped
+# until messages were appended and the history has grown by TOKEN_CHECK_DELTA tokens since then.
+# After a summary, the next "cooldown" checks are skipped too unless the hard limit is exceeded.
+_hist_state = {"len": 0, "tokens": 0, "cooldown": 0}
+# Upper estimate for one tool observation as stored in history (see compact_tool_output). The background context
+# check that runs alongside a tool keeps this much headroom, so the observation fits without another check.
+_OBSERVATION_RESERVE_TOKENS = max(config.TOOL_OUTPUT_SOFT_LIMIT, 2 * config.TOOL_OUTPUT_KEEP_CHARS) // CHARS_PER_TOKEN_ESTIMATE
+_SUMMARY_COOLDOWN_CHECKS = 3
+# Summaries keyed by a hash of the summarized message range, so a range is never sent to the summarizer twice.
+_summary_cache: dict[str, str] = {}
+_SUMMARY_CACHE_MAX_ENTRIES = 32
+# Per-message token estimates, index-aligned with conversation_history, so each message is estimated once.
+# Only append_to_history / evict_oldest_message / prepend_to_history may change either deque.
+_msg_token_counts: deque[int] = deque()
+# Streamed AI text waiting to be written to the console (see print_ai_chunk).
+_AI_OUTPUT_FLUSH_CHARS = 64
+_ai_out_buf: list[str] = []
+_ai_out_len = 0
+# Placeholder for the body of old tool observations (see mask_old_observations).
+_MASKED_OBSERVATION = "<MASKED: observation too old; re-run the tool if you need it again>"
+# Tool argument previews for the console (see _args_preview).
+_ARGS_PREVIEWS: dict[tuple, str] = {}
+_ARGS_PREVIEWS_MAX_ENTRIES = 256
+# Observation headers per tool name, built once (see observation_prefix).
+_OBSERVATION_PREFIXES: dict[str, str] = {}
+# Picks the tool name out of a partially streamed tool call, so it can be announced before the arguments complete.
+_TOOL_NAME_RE = re.compile(r'"tool_name"\s*:\s*"([^"\\]+)"')
 
 # --- Helper Functions ---
 def print_ai_chunk(text_chunk: str):
-    """Prints AI message chunk to console immediately."""
-    print(text_chunk, end="", flush=True)
+    """
+    Buffers an AI message chunk for the console. The buffer is written out at line boundaries or once
+    it exceeds _AI_OUTPUT_FLUSH_CHARS, instead of one write+flush per streamed token.
+    """
+    global _ai_out_len
+    _ai_out_buf.append(text_chunk)
+    _ai_out_len += len(text_chunk)
+    if _ai_out_len > _AI_OUTPUT_FLUSH_CHARS or "\n" in text_chunk: flush_ai_output()
+
+def flush_ai_output():
+    """Writes any buffered AI text to the console. Called on every stream event boundary."""
+    global _ai_out_len
+    if not _ai_out_buf: return
+    sys.stdout.write("".join(_ai_out_buf)); sys.stdout.flush()
+    _ai_out_buf.clear(); _ai_out_len = 0
 
-def print_user_message_log(message: str): logger.info(f"User: {message}")
+def print_user_message_log(message: str):
+    if logger.isEnabledFor(logging.INFO): logger.info("User: %s", message)
+
+def truncate_text(text: str, limit: int) -> str:
+    """Returns text cut to limit chars, with "..." appended if anything was cut."""
+    return text if len(text) <= limit else text[:limit] + "..."
+
+def _args_preview(args: dict) -> str:
+    """Truncated JSON preview of tool arguments, memoized since the AI often repeats the same call."""
+    # Keyed on type + repr of each value: equal-but-different values such as 1, 1.0 and True must not
+    # share a preview, and nested (unhashable) values are covered too.
+    key = tuple((k, type(v), repr(v)) for k, v in args.items())
+    preview = _ARGS_PREVIEWS.get(key)
+    if preview is None:
+        try: args_str = orjson.dumps(args).decode() if orjson is not None else json.dumps(args)
+        except TypeError: args_str = json.dumps(args) # orjson rejects e.g. integers beyond 64 bits
+        preview = truncate_text(args_str, 100)
+        if len(_ARGS_PREVIEWS) >= _ARGS_PREVIEWS_MAX_ENTRIES: del _ARGS_PREVIEWS[next(iter(_ARGS_PREVIEWS))]
+        _ARGS_PREVIEWS[key] = preview
+    return preview
 
 def print_tool_being_used(tool_name: str, tool_args: dict):
-    args_str = json.dumps(tool_args)
-    if len(args_str) > 100: args_str = args_str[:100] + "..."
+    args_str = _args_preview(tool_args)
     # This message is printed *after* AI's preamble (if any) and its final newline.
     message = f"AI is requesting to use tool: '{tool_name}' with arguments: {args_str}"
     logger.info(message)
     print(f"⚙️ System: {message}") # No leading newlines here, rely on context
 
 def print_tool_output(tool_name: str, output: str):
-    logger.info(f"Tool ({tool_name}) Output: {output[:1000]}{'...' if len(output) > 1000 else ''}")
-    print(f"\n🛠️ Tool Output ({tool_name}):\n{output}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Tool (%s) Output: %s", tool_name, truncate_text(output, 1000))
+    # Header and output are written separately, so a large tool output is not copied into one more f-string.
+    write = sys.stdout.write
+    write(f"\n🛠️ Tool Output ({tool_name}):\n"); write(output); write("\n")
+
+def observation_prefix(tool_name: str) -> str:
+    """Returns the cached "Observation for tool 'X':" header for tool_name."""
+    prefix = _OBSERVATION_PREFIXES.get(tool_name)
+    if prefix is None: prefix = _OBSERVATION_PREFIXES[tool_name] = f"Observation for tool '{tool_name}':\n"
+    return prefix
+
+def compact_tool_output(tool_name: str, output: str) -> str:
+    """
+    Returns the version of a tool output that is stored in conversation history.
+    Outputs longer than TOOL_OUTPUT_SOFT_LIMIT chars keep only their head and tail, so a large
+    scan dump is not re-sent with every later request. The full text is still printed and logged.
+    """
+    keep = config.TOOL_OUTPUT_KEEP_CHARS
+    if len(output) <= max(config.TOOL_OUTPUT_SOFT_LIMIT, 2 * keep): return output
+    elided_end = len(output) - keep
+    elided_lines = output.count("\n", keep, elided_end)
+    if logger.isEnabledFor(logging.DEBUG): logger.debug("Full output of tool '%s' before compaction:\n%s", tool_name, output)
+    return (f"{output[:keep]}\n[... {elided_end - keep} chars ({elided_lines} lines) elided from history; "
+            f"re-run a narrower command if you need this part ...]\n{output[elided_end:]}")
 
 def print_system_console_message(message: str, is_error=False):
     log_level = logging.ERROR if is_error else logging.INFO
-    logger.log(log_level, f"SystemConsole: {message}")
+    logger.log(log_level, "SystemConsole: %s", message)
     print(f"\n⚙️ System:\n{message}")
 
-def manage_conversation_history_and_summarize():
-    global conversation_history
-    current_tokens = estimate_messages_token_count(conversation_history)
-    logger.debug(f"Current estimated token count: {current_tokens}. Soft limit: {config.CONTEXT_TOKEN_SOFT_LIMIT}")
-    if current_tokens > config.CONTEXT_TOKEN_SOFT_LIMIT and len(conversation_history) > config.MIN_MESSAGES_TO_KEEP_BEFORE_SUMMARY:
-        print_system_console_message(f"Context length ({current_tokens} tokens) nearing limit. Attempting summarization...")
-        messages_to_keep_suffix = conversation_history[-config.MIN_MESSAGES_TO_KEEP_BEFORE_SUMMARY:]
-        messages_to_summarize = conversation_history[:-config.MIN_MESSAGES_TO_KEEP_BEFORE_SUMMARY]
+def evict_oldest_message() -> int:
+    """Pops the oldest history message together with its token estimate and returns the estimate."""
+    conversation_history.popleft()
+    return _msg_token_counts.popleft()
+
+def append_to_history(*messages: Msg):
+    """Appends messages to conversation_history and adds their estimated tokens to the running total."""
+    global _running_tokens
+    counts = [estimate_message_token_count(m) for m in messages]
+    conversation_history.extend(messages)
+    _msg_token_counts.extend(counts)
+    _running_tokens += sum(counts)
+
+def prepend_to_history(message: Msg) -> int:
+    """Inserts a message (e.g. a summary) at the start of conversation_history. Returns its token estimate; the caller owns _running_tokens."""
+    tokens = estimate_message_token_count(message)
+    conversation_history.appendleft(message)
+    _msg_token_counts.appendleft(tokens)
+    return tokens
+
+def trim_history_to_token_limit(current_tokens: int, token_limit: int) -> int:
+    """Drops the oldest messages (keeping at least MIN_MESSAGES_TO_KEEP_BEFORE_SUMMARY) until under token_limit. Returns the new token count."""
+    dropped, min_keep = 0, config.MIN_MESSAGES_TO_KEEP_BEFORE_SUMMARY
+    while current_tokens > token_limit and len(conversation_history) > min_keep:
+        current_tokens -= evict_oldest_message()
+        dropped += 1
+    if dropped: logger.warning(f"Dropped {dropped} oldest messages from history. Estimated tokens now: {current_tokens}")
+    return current_tokens
+
+def calibrate_token_estimate(estimated_prompt_tokens: int):
+    """Updates _token_scale from the API-reported size of the request that was estimated at estimated_prompt_tokens."""
+    global _token_scale
+    actual_tokens = get_ai_client().last_prompt_tokens
+    if not actual_tokens or estimated_prompt_tokens <= 0: return
+    _token_scale = min(max(actual_tokens / estimated_prompt_tokens, _TOKEN_SCALE_RANGE[0]), _TOKEN_SCALE_RANGE[1])
+    logger.debug("Prompt tokens: %d reported, %d estimated. Token scale: %.2f", actual_tokens, estimated_prompt_tokens, _token_scale)
+
+def slide_history_window(current_tokens: int, token_limit: int) -> int | None:
+    """
+    Drops the oldest messages after a leading summary until the history fits token_limit, without an API call.
+    The kept messages start on a user turn. Returns the new token count, or None (history unchanged) if the
+    window would drop a tool observation that still has its body, or keep fewer than MIN_MESSAGES_TO_KEEP_BEFORE_SUMMARY.
+    """
+    start = 1 if conversation_history and conversation_history[0].role == "system" else 0
+    end, tokens = start, current_tokens
+    while end < len(conversation_history) and (tokens > token_limit or conversation_history[end].role != "user"):
+        message = conversation_history[end]
+        if message.role == "user" and isinstance(message.content, str) and message.content.startswith("Observation for tool '") \
+                and not message.content.endswith(_MASKED_OBSERVATION):
+            return None # Still-unmasked evidence; let the summarizer condense it instead of losing it
+        tokens -= _msg_token_counts[end]; end += 1
+    if end == start or len(conversation_history) - (end - start) < config.MIN_MESSAGES_TO_KEEP_BEFORE_SUMMARY: return None
+    for _ in range(end - start):
+        del conversation_history[start]; del _msg_token_counts[start]
+    logger.info(f"Sliding window dropped {end - start} oldest messages. Estimated tokens now: {tokens}")
+    return tokens
+
+def coalesce_messages(messages) -> list[dict]:
+    """
+    Returns the Msg history as API message dicts, with runs of same-role string messages merged into one.
+    E.g. a user question directly after a tool observation becomes a single user turn.
+    conversation_history itself is left unchanged; this is the only place history is converted to dicts.
+    Each run is joined once, so a chain of large tool observations is copied a single time.
+    """
+    merged, run = [], [] # run: same-role string messages not yet added to merged
+    for message in itertools.chain(messages, (None,)):
+        if message is not None and run and message.role == run[0].role and isinstance(message.content, str):
+            run.append(message); continue
+        if len(run) > 1: merged.append({"role": run[0].role, "content": "\n\n".join(m.content for m in run)})
+        elif run: merged.append(run[0].to_dict())
+        if message is None: break
+        if isinstance(message.content, str): run = [message]
+        else: merged.append(message.to_dict()); run = []
+    return merged
+
+def mask_old_observations() -> int:
+    """
+    Replaces the body of tool observations older than the last MIN_MESSAGES_TO_KEEP_BEFORE_SUMMARY messages
+    with a short placeholder, keeping their "Observation for tool 'X':" header. Returns the tokens saved.
+    """
+    saved_tokens = 0
+    for index in range(len(conversation_history) - config.MIN_MESSAGES_TO_KEEP_BEFORE_SUMMARY):
+        message = conversation_history[index]
+        content = message.content
+        if message.role != "user" or not isinstance(content, str) or not content.startswith("Observation for tool '"): continue
+        header, _, body = content.partition("\n")
+        if not body or body == _MASKED_OBSERVATION: continue
+        masked_message = Msg("user", f"{header}\n{_MASKED_OBSERVATION}")
+        masked_tokens = estimate_message_token_count(masked_message)
+        if masked_tokens >= _msg_token_counts[index]: continue
+        saved_tokens += _msg_token_counts[index] - masked_tokens
+        conversation_history[index], _msg_token_counts[index] = masked_message, masked_tokens
+    return saved_tokens
+
+def summary_range_key(messages: list[Msg]) -> str:
+    """Content hash of a message range, used as the _summary_cache key."""
+    digest = hashlib.blake2b(digest_size=16)
+    for message in messages:
+        digest.update(f"{message.role}\x00{message.content}\x00".encode("utf-8"))
+    return digest.hexdigest()
+
+def manage_conversation_history_and_summarize(reserve_tokens: int = 0, notices: list | None = None):
+    """
+    Keeps conversation_history within the context limits (mask, optional sliding window, summarize).
+    reserve_tokens: headroom to keep for a message that is about to be appended (a pending tool observation).
+        A check with a reserve always runs, since the growth it plans for has not happened yet.
+    notices: if given, console messages are collected here as (message, is_error) instead of printed,
+        so a check running alongside a tool does not interleave with the tool's output.
+    """
+    global _running_tokens
+    notify = print_system_console_message if notices is None else (lambda message, is_error=False: notices.append((message, is_error)))
+    if not reserve_tokens and (len(conversation_history) == _hist_state["len"] or _running_tokens - _hist_state["tokens"] < config.TOKEN_CHECK_DELTA):
+        return False
+    # History budgets (in estimated tokens): the calibrated context limits minus the system prompt sent with every request
+    # and any reserved headroom.
+    system_prompt_tokens = get_system_prompt_tokens()
+    soft_limit = int(config.CONTEXT_TOKEN_SOFT_LIMIT / _token_scale) - system_prompt_tokens - reserve_tokens
+    hard_limit = int(config.CONTEXT_TOKEN_HARD_LIMIT / _token_scale) - system_prompt_tokens - reserve_tokens
+    if _hist_state["cooldown"] and _running_tokens <= hard_limit:
+        _hist_state["cooldown"] -= 1 # Recently summarized; don't re-summarize while the summary + tail still sit near the soft limit
+        return False
+    current_tokens = _running_tokens
+    _hist_state["len"], _hist_state["tokens"] = len(conversation_history), current_tokens
+    logger.debug("Current estimated history token count: %d. Soft limit for history: %d", current_tokens, soft_limit) # Lazy: runs every check
+    if current_tokens > soft_limit and len(conversation_history) > config.MIN_MESSAGES_TO_KEEP_BEFORE_SUMMARY:
+        # First tier: mask old tool observations (no API call). Summarize only if that is not enough.
+        saved_tokens = mask_old_observations()
+        if saved_tokens:
+            _running_tokens -= saved_tokens; current_tokens = _running_tokens
+            _hist_state["tokens"] = current_tokens
+            logger.info(f"Masked old tool observations, saving ~{saved_tokens} tokens. Estimated tokens now: {current_tokens}")
+            if current_tokens <= soft_limit: return True
+        if config.SLIDING_WINDOW_TRIM_ENABLED:
+            # Second tier: slide the window over old plain messages (no API call). Summarize only if that would lose evidence.
+            window_tokens = slide_history_window(current_tokens, soft_limit)
+            if window_tokens is not None:
+                _running_tokens = window_tokens
+                _hist_state["len"], _hist_state["tokens"] = len(conversation_history), _running_tokens
+                return True
+        notify(f"Context length ({current_tokens} tokens) nearing limit. Attempting summarization...")
+        # Keep the newest messages verbatim until they reach SUMMARIZED_HISTORY_TAIL_TOKENS; summarize everything older.
+        kept_count, kept_tokens, tail_tokens = 0, 0, config.SUMMARIZED_HISTORY_TAIL_TOKENS
+        for tokens in reversed(_msg_token_counts):
+            if kept_tokens >= tail_tokens: break
+            kept_tokens += tokens; kept_count += 1
+        split_index = len(conversation_history) - kept_count
+        # Start the kept tail on a user turn, so the conversation after the summary opens with the user.
+        while 0 < split_index < len(conversation_history) and conversation_history[split_index].role != "user":
+            split_index -= 1; kept_tokens += _msg_token_counts[split_index]
+        messages_to_summarize = list(itertools.islice(conversation_history, 0, split_index))
         if not messages_to_summarize: logger.info("Not enough messages to summarize."); return False
-        summary_text = ai_client.summarize_conversation(messages_to_summarize, config.SUMMARIZED_HISTORY_TARGET_TOKENS)
-        if interrupt_handler.is_interrupted(): print_system_console_message("Summarization interrupted."); return True
+        # A previous summary is the first message of the range, so only messages added since then are new
+        # to the summarizer; the cache additionally skips the call for a range that was already summarized.
+        range_key = summary_range_key(messages_to_summarize)
+        summary_text = _summary_cache.get(range_key)
+        if summary_text is None:
+            summary_text = get_ai_client().summarize_conversation([m.to_dict() for m in messages_to_summarize], config.SUMMARIZED_HISTORY_TARGET_TOKENS)
+            if interrupt_handler.is_interrupted(): notify("Summarization interrupted."); return True
+            if summary_text:
+                if len(_summary_cache) >= _SUMMARY_CACHE_MAX_ENTRIES: del _summary_cache[next(iter(_summary_cache))]
+                _summary_cache[range_key] = summary_text
+        else:
+            logger.info(f"Reusing cached summary for {len(messages_to_summarize)} messages.")
         if summary_text:
-            new_history = [{"role": "system", "content": f"Previous conversation summary: {summary_text}"}]
-            new_history.extend(messages_to_keep_suffix)
-            conversation_history = new_history
-            print_system_console_message("Conversation history summarized.")
+            # Evict the summarized prefix in place; the kept suffix is never copied.
+            for _ in range(split_index): evict_oldest_message()
+            summary_message = Msg("system", f"Previous conversation summary: {summary_text}")
+            # New total = kept suffix (summed during the split walk) + summary; no rescan of the retained messages.
+            _running_tokens = kept_tokens + prepend_to_history(summary_message)
+            _hist_state["len"], _hist_state["tokens"] = len(conversation_history), _running_tokens
+            _hist_state["cooldown"] = _SUMMARY_COOLDOWN_CHECKS
+            notify("Conversation history summarized.")
             return True
         else:
-            print_system_console_message("Failed to summarize conversation history.", is_error=True)
-            if current_tokens > config.CONTEXT_TOKEN_HARD_LIMIT:
-                 print_system_console_message(f"WARNING: Token count ({current_tokens}) exceeds hard limit.", is_error=True)
+            notify("Failed to summarize conversation history.", is_error=True)
+            if current_tokens > hard_limit:
+                 notify(f"WARNING: Token count ({current_tokens}) exceeds hard limit. Dropping oldest messages.", is_error=True)
+                 _running_tokens = trim_history_to_token_limit(current_tokens, hard_limit)
+                 _hist_state["len"], _hist_state["tokens"] = len(conversation_history), _running_tokens
             return True
     return False
 
-def execute_tool(tool_name: str, arguments: dict) -> str:
-    if tool_name in available_tools:
-        tool = available_tools[tool_name]
-        if tool_name == "command_line" and config.REQUIRE_COMMAND_CONFIRMATION:
-            command_to_run = arguments.get("command")
-            if command_to_run and not arguments.get("stdin_input") and not arguments.get("terminate_interactive"):
-                print() # Newline before input prompt
-                confirm_prompt = f"AI wants to execute: '{command_to_run}'. Allow? (yes/no): "
-                try:
-                    user_confirmation = input(confirm_prompt).strip().lower()
-                    if user_confirmation != "yes": return "User declined command execution."
-                except (EOFError, KeyboardInterrupt):
-                    interrupt_handler.handle_interrupt(None, None)
-                    return "User interrupted command confirmation."
-        tool.set_interrupted(interrupt_handler.is_interrupted())
-        return tool.execute(arguments)
-    return f"Error: Tool '{tool_name}' not found."
+def get_tool(tool_name: str) -> BaseTool | None:
+    """Returns the tool instance for tool_name, importing and creating it on first use. None if unknown."""
+    tool = available_tools.get(tool_name)
+    if tool is None and tool_name in _TOOL_SPECS:
+        module_name, class_name = _TOOL_SPECS[tool_name]
+        tool = available_tools[tool_name] = getattr(importlib.import_module(module_name), class_name)(interrupt_source=interrupt_handler)
+        logger.info(f"Tool initialized on first use: {tool_name}")
+    return tool
+
+def needs_confirmation(tool: BaseTool | None, arguments: dict) -> bool:
+    """True if running this tool call will first ask the user for approval on stdin."""
+    return (tool is not None and tool.requires_confirmation and config.REQUIRE_COMMAND_CONFIRMATION
+            and bool(arguments.get("command")) and not arguments.get("stdin_input") and not arguments.get("terminate_interactive"))
+
+def execute_tool(tool_name: str, arguments: dict) -> ToolResult:
+    tool = get_tool(tool_name)
+    if tool is not None:
+        if needs_confirmation(tool, arguments):
+            print() # Newline before input prompt
+            confirm_prompt = f"AI wants to execute: '{arguments['command']}'. Allow? (yes/no): "
+            try:
+                user_confirmation = input(confirm_prompt).strip().lower()
+                if user_confirmation != "yes": return ToolResult(ToolResult.USER_DECLINED, "User declined command execution.")
+            except (EOFError, KeyboardInterrupt):
+                interrupt_handler.handle_interrupt(None, None)
+                return ToolResult(ToolResult.CONFIRM_INTERRUPTED, "User interrupted command confirmation.")
+        cache_key = _tool_cache.make_key(tool_name, arguments) if tool.cache_ttl > 0 else None
+        if cache_key is not None:
+            cached_output = _tool_cache.get(cache_key, tool.cache_ttl)
+            if cached_output is not None:
+                logger.info("Serving cached result for tool '%s' (key %s).", tool_name, cache_key[:12])
+                return ToolResult(ToolResult.OK, cached_output)
+        timeout = config.TOOL_EXECUTION_TIMEOUT if tool.timeout == 0 else tool.timeout
+        future = run_in_background(tool.execute, arguments, name=f"tool-{tool_name}")
+        try:
+            output = future.result(timeout=timeout)
+        except FuturesTimeout:
+            # The thread cannot be killed; it is left to finish in the background and its result is discarded.
+            logger.warning(f"Tool '{tool_name}' did not finish within {timeout}s; abandoning the call.")
+            return ToolResult(ToolResult.TIMED_OUT, f"Error: Tool '{tool_name}' timed out after {timeout} seconds.")
+        if isinstance(output, ToolResult): return output # Tool reported its own status
+        # Plain str output (shim for tools without structured results): infer the status from the interrupt flag.
+        status = ToolResult.EXEC_INTERRUPTED if interrupt_handler.is_interrupted() else ToolResult.OK
+        if cache_key is not None and status == ToolResult.OK and tool.is_cacheable(output): _tool_cache.put(cache_key, output)
+        return ToolResult(status, output)
+    return ToolResult(ToolResult.OK, f"Error: Tool '{tool_name}' not found.")
+
+def handle_batch_input(user_input: str):
+    """Queues a "#batch" prompt and sends the queue once it is full or "#flush" was entered."""
+    if user_input != _FLUSH_COMMAND:
+        prompt = user_input[len(_BATCH_PREFIX):].strip()
+        if prompt:
+            _batch_queue.append(prompt)
+            print_system_console_message(f"Prompt queued for batch processing ({len(_batch_queue)}/{config.BATCH_QUEUE_SIZE}). Type '{_FLUSH_COMMAND}' to send now.")
+        elif _batch_queue:
+            print_system_console_message(f"No prompt given (usage: '{_BATCH_PREFIX}<prompt>'). {len(_batch_queue)}/{config.BATCH_QUEUE_SIZE} prompt(s) queued; type '{_FLUSH_COMMAND}' to send now.")
+    if _batch_queue and (user_input == _FLUSH_COMMAND or len(_batch_queue) >= config.BATCH_QUEUE_SIZE):
+        run_batched_prompts()
+    elif not _batch_queue:
+        print_system_console_message("No batched prompts queued.")
+
+def run_batched_prompts(requeue_on_failure: bool = True) -> bool:
+    """
+    Sends all queued prompts as one Message Batches API request, each answered against the current
+    conversation, waits for the results (Ctrl+C stops waiting and cancels the batch) and records every
+    prompt/answer pair in conversation_history in queue order.
+    If submission fails, the prompts stay queued for the next attempt unless requeue_on_failure is False.
+    Returns True if every prompt was answered.
+    """
+    prompts = _batch_queue[:]
+    _batch_queue.clear()
+    base_messages = list(conversation_history)
+    batch_id = get_ai_client().create_message_batch(
+        [(f"prompt-{i}", coalesce_messages(base_messages + [Msg("user", prompt)])) for i, prompt in enumerate(prompts)])
+    if batch_id is None:
+        if requeue_on_failure:
+            _batch_queue[:0] = prompts # Keep them queued for the next attempt
+            print_system_console_message("Failed to submit batched prompts. They are still queued.", is_error=True)
+        else:
+            print_system_console_message("Failed to submit batched prompts.", is_error=True)
+        return False
+    print_system_console_message(f"Submitted {len(prompts)} prompt(s) as batch {batch_id}. Waiting for results (Ctrl+C to stop waiting)...")
+    poll_delay = config.BATCH_POLL_SECONDS
+    while (results := get_ai_client().get_message_batch_results(batch_id)) is None:
+        wait_until = time.monotonic() + poll_delay
+        while time.monotonic() < wait_until:
+            if interrupt_handler.is_interrupted():
+                get_ai_client().cancel_message_batch(batch_id)
+                print_system_console_message(f"Stopped waiting; batch {batch_id} was cancelled.")
+                return False
+            time.sleep(0.5)
+        poll_delay = min(poll_delay * 2, config.BATCH_POLL_MAX_SECONDS)
+    for i, prompt in enumerate(prompts):
+        answer = results.get(f"prompt-{i}")
+        print(f"\n👤 You (batched): {prompt}\n\n🤖 Assistant: {answer or '[No result for this prompt]'}")
+        if answer: append_to_history(Msg("user", prompt), Msg("assistant", answer))
+    return all(results.get(f"prompt-{i}") for i in range(len(prompts)))
+
+def complete_input_command(text: str, state: int) -> str | None:
+    """readline completer: Tab-completes the app's own commands at the start of the input line."""
+    if readline.get_begidx() != 0: return None
+    matches = [word for word in _COMPLETION_WORDS if word.startswith(text)]
+    return matches[state] if state < len(matches) else None
+
+def is_input_command(line: str) -> bool:
+    """True for input lines handled by the app itself (exit, #batch, #flush) rather than sent to the AI."""
+    # A bare "#batch" (input lines are stripped, e.g. after Tab completion) is a command too, not a prompt.
+    return line.lower() in _EXIT_COMMANDS or line.startswith(_BATCH_PREFIX) or line in (_FLUSH_COMMAND, _BATCH_PREFIX.strip())
+
+def read_user_input(prompt: str) -> str:
+    """
+    Reads one user turn. On an interactive terminal, lines already waiting on stdin (e.g. a multi-line
+    paste) are merged into the same turn, so they cost one AI request instead of one request each.
+    Command lines are never merged; they are kept back and returned by the next call.
+    """
+    if _pending_input: return _pending_input.popleft()
+    lines = [input(prompt).strip()]
+    if readline is None or not lines[0] or is_input_command(lines[0]): return lines[0]
+    while select.select([sys.stdin], [], [], 0)[0]:
+        try: line = input().strip()
+        except EOFError: break
+        if is_input_command(line): _pending_input.append(line); break
+        if line: lines.append(line)
+    if len(lines) > 1: logger.info(f"Merged {len(lines)} pending input lines into one turn.")
+    return "\n".join(lines)
+
+def main_batch(prompts_path: str) -> int:
+    """
+    Answers every non-empty line of prompts_path as an independent prompt in one Message Batches request.
+    Returns the process exit status: 0 if every prompt was answered, 1 otherwise.
+    """
+    initialize_app()
+    try:
+        with open(prompts_path, "r", encoding="utf-8") as f: prompts = [line.strip() for line in f if line.strip()]
+    except OSError as e:
+        print_system_console_message(f"Could not read batch prompts file: {e}", is_error=True); return 1
+    if not prompts:
+        print_system_console_message(f"No prompts found in {prompts_path}.", is_error=True); return 1
+    start_ai_client_init()
+    _batch_queue.extend(prompts) # Submitted together, regardless of BATCH_QUEUE_SIZE
+    all_answered = run_batched_prompts(requeue_on_failure=False)
+    print_system_console_message(f"Exiting {config.SERVICE_NAME}.")
+    return 0 if all_answered else 1
 
 # --- Main Application Loop ---
 def main():
-    global conversation_history
+    initialize_app()
+    start_ai_client_init() # Runs while the first prompt is typed
     print_system_console_message(f"{config.SERVICE_NAME} started. Type 'exit' or 'quit' to end.")
-    logger.info(f"Application main loop started. Model: {ai_client.model_name}, Max Output Tokens: {config.MAX_AI_OUTPUT_TOKENS}")
+    if readline is not None:
+        readline.set_completer_delims(" \t\n") # "#batch" and "#flush" are completed as whole words
+        readline.set_completer(complete_input_command)
+        readline.parse_and_bind("tab: complete")
+    logger.info(f"Application main loop started. Model: {config.DEFAULT_AI_MODEL}, Max Output Tokens: {config.MAX_AI_OUTPUT_TOKENS}")
+    # Per-segment buffers, allocated once and reset at the start of every segment.
+    segment_buf = io.StringIO()
+    segment_messages = []
     
     while True: # Outer loop for user input
         interrupt_handler.reset()
-        ai_client.set_interrupted(False)
-        for tool in available_tools.values(): tool.set_interrupted(False)
 
         print() 
         try:
-            user_input = input("👤 You: ").strip()
+            user_input = read_user_input("👤 You: ")
         except KeyboardInterrupt:
             if interrupt_handler.is_interrupted(): break
             interrupt_handler.handle_interrupt(None, None)
@@ -136,11 +617,14 @@ def main():
             continue
         except EOFError: break
         
-        if user_input.lower() in ["exit", "quit"]: break
         if not user_input: continue
+        if is_input_command(user_input):
+            if user_input.lower() in _EXIT_COMMANDS: break
+            handle_batch_input(user_input)
+            continue
 
         print_user_message_log(user_input)
-        conversation_history.append({"role": "user", "content": user_input})
+        append_to_history(Msg("user", user_input))
         
         needs_ai_to_respond = True
         while needs_ai_to_respond:
@@ -153,107 +637,157 @@ def main():
 
             print(f"\n🤖 Assistant: ", end="", flush=True) # Start AI response line
             
-            accumulated_text_chunks_for_log = [] # For logging the full text segment
-            # This will store the text part of the AI's response for the current segment.
-            # If a tool call is detected, this will be the preamble.
-            # If the stream completes without a tool call, this will be the full text.
-            current_ai_speech_segment = [] 
+            # Text streamed for the current segment. If a tool call is detected, this is the preamble;
+            # if the stream completes without a tool call, this is the full text. Read once after the loop.
+            segment_buf.seek(0); segment_buf.truncate()
             tool_call_action = None 
+            tool_call_text = None
+            tool_args_parts = [] # Tool call JSON streamed so far, until the tool name is known
+            announced_tool_name = None
             final_stop_reason_for_segment = None
             
-            for event_type, data, *extra in ai_client.get_response_stream(SYSTEM_PROMPT, conversation_history):
-                if interrupt_handler.is_interrupted():
-                    if accumulated_text_chunks_for_log: print() 
+            # Hot path locals: one event arrives per streamed token group, so the interrupt flag is read as a
+            # plain attribute (no method call) and the per-delta callables are bound once per segment.
+            interrupt_source = interrupt_handler
+            print_chunk, write_segment = print_ai_chunk, segment_buf.write
+            estimated_prompt_tokens = _running_tokens + get_system_prompt_tokens()
+            for event_type, data, extra in get_ai_client().get_response_stream(coalesce_messages(conversation_history)):
+                if event_type == "text_chunk":
+                    if interrupt_source.interrupted:
+                        flush_ai_output(); print()
+                        print_system_console_message("Stream consumption interrupted by user.")
+                        needs_ai_to_respond = False
+                        break
+                    print_chunk(data) 
+                    write_segment(data)
+                    continue
+
+                flush_ai_output() # Event boundary: show all buffered text before any status output
+                if interrupt_source.interrupted:
+                    if segment_buf.tell(): print() 
                     print_system_console_message("Stream consumption interrupted by user.")
                     needs_ai_to_respond = False 
                     break 
 
-                if event_type == "text_chunk":
-                    print_ai_chunk(data) 
-                    accumulated_text_chunks_for_log.append(data)
-                    current_ai_speech_segment.append(data)
+                if event_type == "tool_call_start":
+                    # The tool call JSON is not echoed; show a status line as soon as the call begins instead.
+                    print_system_console_message("AI is preparing a tool call...")
+                    tool_args_parts, announced_tool_name = [], None
+                elif event_type == "tool_args_delta":
+                    if announced_tool_name is None:
+                        tool_args_parts.append(data)
+                        name_match = _TOOL_NAME_RE.search("".join(tool_args_parts))
+                        if name_match:
+                            announced_tool_name = name_match.group(1)
+                            print(f"Tool: '{announced_tool_name}' (receiving arguments...)", flush=True)
                 elif event_type == "first_tool_call_details":
-                    # data is preamble_text, extra[0] is tool_name, extra[1] is tool_args
-                    # The preamble_text (data) is what the client parsed *before* the <tool_call> tag.
-                    # The text chunks already printed via print_ai_chunk form this preamble.
-                    # So, current_ai_speech_segment now holds this preamble.
-                    tool_name, tool_args = extra[0], extra[1]
+                    # data is the preamble plus the raw <tool_call> block, extra is (tool_name, tool_args).
+                    # segment_buf only holds the printed preamble; data is what gets recorded as the assistant turn.
+                    tool_name, tool_args = extra
                     tool_call_action = (tool_name, tool_args)
+                    tool_call_text = data
                     final_stop_reason_for_segment = "first_tool_call_yielded"
-                    logger.info(f"Tool call received from stream: {tool_name}. Preamble (data from client): '{data}'")
+                    logger.info("Tool call received from stream: %s. Call text (data from client): '%s'", tool_name, data)
                     break 
                 elif event_type == "stream_complete":
-                    final_stop_reason_for_segment = extra[0]
+                    final_stop_reason_for_segment = extra
                     # 'data' from stream_complete is the full text from client buffer.
-                    # We have already printed chunks and accumulated them in current_ai_speech_segment.
-                    # If 'data' is different, it might be a fallback; for now, trust accumulated.
-                    # If accumulated is empty but data is not (e.g. very short message not chunked), use data.
-                    if not current_ai_speech_segment and data:
+                    # We have already printed chunks and written them to segment_buf; trust those.
+                    # If nothing was buffered but data is not empty (e.g. very short message not chunked), use data.
+                    if not segment_buf.tell() and data:
                         print_ai_chunk(data) # Print it if not already printed
-                        current_ai_speech_segment.append(data)
-                    accumulated_text_chunks_for_log.extend(current_ai_speech_segment) # Ensure log has it
-                    logger.info(f"AI stream segment ended. Reason: {final_stop_reason_for_segment}")
+                        segment_buf.write(data)
+                    logger.info("AI stream segment ended. Reason: %s", final_stop_reason_for_segment)
                     break 
                 elif event_type in ["error", "interrupted"]:
-                    if accumulated_text_chunks_for_log: print() 
+                    if segment_buf.tell(): print() 
                     print_system_console_message(f"Stream error/interrupt from client: {event_type} - {data}", is_error=True)
-                    final_stop_reason_for_segment = extra[0] if extra else event_type
+                    final_stop_reason_for_segment = extra or event_type
                     needs_ai_to_respond = False 
                     break
             
             # After stream consumption loop
-            if accumulated_text_chunks_for_log: # If any text was streamed for this segment
-                print() # Ensure a final newline after AI's text
-                logger.info(f"AI Full Segment Log: {''.join(accumulated_text_chunks_for_log)}")
+            flush_ai_output()
+            calibrate_token_estimate(estimated_prompt_tokens)
+            segment_text = segment_buf.getvalue()
+            if segment_text: # If any text was streamed for this segment
+                if tool_call_text is None: print() # Ensure a final newline after AI's text (a tool call already ended the line)
+                if logger.isEnabledFor(logging.INFO): logger.info("AI Full Segment Log: %s", segment_text)
 
             if not needs_ai_to_respond: break 
 
+            # Messages produced by this segment are collected here and added to history with a single extend.
+            segment_messages.clear()
+            context_future, context_notices = None, []
+
             # Add assistant's message (preamble or full text) to history
-            assistant_message_for_history = "".join(current_ai_speech_segment).strip()
+            assistant_message_for_history = (tool_call_text or segment_text).strip()
             if assistant_message_for_history:
                 # Check if this exact message (as assistant) is already the last one to avoid duplicates
                 # This can happen if a tool call is detected immediately after text, and text was already added.
                 # More robustly, only add if it's different from last assistant message or if last wasn't assistant.
                 if not conversation_history or \
-                   not (conversation_history[-1]["role"] == "assistant" and conversation_history[-1]["content"] == assistant_message_for_history):
-                    conversation_history.append({"role": "assistant", "content": assistant_message_for_history})
+                   not (conversation_history[-1].role == "assistant" and conversation_history[-1].content == assistant_message_for_history):
+                    segment_messages.append(Msg("assistant", assistant_message_for_history))
                 else:
                     logger.debug("Skipping duplicate assistant message to history.")
 
 
             if tool_call_action:
                 tool_name, tool_args = tool_call_action
+                if not needs_confirmation(get_tool(tool_name), tool_args):
+                    # Record the assistant turn now: history is then not touched again until the observation is
+                    # appended, so context management (possibly a summarization request) runs while the tool does.
+                    # It makes room for the observation up front, so the check before the next request has nothing
+                    # left to do. Its console messages are held until the tool is done. Skipped when the tool will
+                    # prompt on stdin.
+                    if segment_messages: append_to_history(*segment_messages); segment_messages.clear()
+                    context_future = _CONTEXT_POOL.submit(manage_conversation_history_and_summarize, _OBSERVATION_RESERVE_TOKENS, context_notices)
                 print_tool_being_used(tool_name, tool_args)
-                tool_output_str = execute_tool(tool_name, tool_args)
+                tool_result = execute_tool(tool_name, tool_args)
+                tool_output_str = tool_result.output
 
-                if "User interrupted command confirmation." in tool_output_str and interrupt_handler.is_interrupted():
+                if tool_result.status == ToolResult.CONFIRM_INTERRUPTED:
                     print_system_console_message("Command confirmation was interrupted.")
-                    conversation_history.append({"role": "user", "content": f"Observation: I interrupted the confirmation for your request to run '{tool_args.get('command')}'."})
+                    segment_messages.append(Msg("user", f"Observation: I interrupted the confirmation for your request to run '{tool_args.get('command')}'."))
                 else:
                     print_tool_output(tool_name, tool_output_str)
-                    observation_content = f"Observation for tool '{tool_name}':\n{tool_output_str}"
-                    conversation_history.append({"role": "user", "content": observation_content})
-                    if "Command interrupted." in tool_output_str and interrupt_handler.is_interrupted():
+                    observation_content = "".join((observation_prefix(tool_name), compact_tool_output(tool_name, tool_output_str)))
+                    segment_messages.append(Msg("user", observation_content))
+                    if tool_result.status == ToolResult.EXEC_INTERRUPTED:
                          print_system_console_message(f"Tool '{tool_name}' execution was interrupted.")
                 
                 needs_ai_to_respond = True 
             
             elif final_stop_reason_for_segment == "max_tokens":
                 print_system_console_message("Warning: AI's response was cut short. It may try to continue.", is_error=True)
-                conversation_history.append({"role": "user", "content": "Observation: Your previous response was truncated. Please continue."})
+                segment_messages.append(Msg("user", "Observation: Your previous response was truncated. Please continue."))
                 needs_ai_to_respond = True
             
             else: 
                 needs_ai_to_respond = False 
 
+            if context_future is not None:
+                context_future.result(); context_future = None # Must finish before history changes again
+                for message, is_error in context_notices: print_system_console_message(message, is_error=is_error)
+            if segment_messages: append_to_history(*segment_messages)
+
     print_system_console_message(f"Exiting {config.SERVICE_NAME}.")
 
 if __name__ == "__main__":
-    try: main()
-    except SystemExit: pass
+    arg_parser = argparse.ArgumentParser(description="AI assistant for penetration testing on Kali Linux.")
+    arg_parser.add_argument("--batch", metavar="PROMPTS_FILE", help="Answer each line of PROMPTS_FILE through the Message Batches API and exit.")
+    cli_args = arg_parser.parse_args()
+    exit_code = 0
+    try:
+        if cli_args.batch: exit_code = main_batch(cli_args.batch)
+        else: main()
+    except SystemExit as e: exit_code = e.code
     except Exception as e:
         logger.critical(f"--- Main loop critical error: {e} ---", exc_info=True)
         print(f"\n--- CRITICAL ERROR: {e} ---", file=sys.stderr)
+        exit_code = 1
     finally:
         logger.info("Application terminated.")
         print("\nApplication terminated.")
+    sys.exit(exit_code)
@@ -1,38 +1,96 @@
 # tools/base_tool.py
+import time
 from abc import ABC, abstractmethod
+from typing import NamedTuple
+
+class ToolResult(NamedTuple):
+    """
+    Result of a tool dispatch: an integer status code plus the output text.
+    The status lets callers branch on outcomes without scanning the output text.
+    """
+    status: int
+    output: str
+
+    OK = 0
+    USER_DECLINED = 1
+    CONFIRM_INTERRUPTED = 2
+    EXEC_INTERRUPTED = 3
+    TIMED_OUT = 4
 
 class BaseTool(ABC):
     """
     Abstract base class for all tools.
     """
-    def __init__(self, name, description):
+    # Seconds the app waits for execute() to return. 0 uses config.TOOL_EXECUTION_TIMEOUT, None waits indefinitely.
+    timeout = 0
+    # True if new executions need the user's approval when REQUIRE_COMMAND_CONFIRMATION is enabled.
+    requires_confirmation = False
+    # Seconds a successful result may be reused for a call with identical arguments. 0 disables caching.
+    cache_ttl = 0
+
+    def __init__(self, name, description, interrupt_source=None):
         """
         Initializes the tool.
         Args:
             name (str): The name of the tool (should match what AI uses).
             description (str): A brief description of what the tool does.
+            interrupt_source: Optional shared object with an `interrupted` bool (e.g. the app's InterruptHandler).
+                              If given, the tool reads that flag directly instead of keeping its own copy.
         """
         self.name = name
         self.description = description
-        self.interrupted = False # Flag for interruption
+        self._interrupt_source = interrupt_source
+        self._interrupted = False # Own flag, used when there is no shared interrupt_source
+
+    @property
+    def interrupted(self):
+        """True if an interrupt has been signalled for this tool."""
+        if self._interrupt_source is not None: return self._interrupt_source.interrupted
+        return self._interrupted
 
     def set_interrupted(self, interrupted_status):
-        """Sets the interruption status."""
-        self.interrupted = interrupted_status
+        """Sets the interruption status. Only affects tools without a shared interrupt_source."""
+        self._interrupted = interrupted_status
+
+    def wait_interruptible(self, seconds: float) -> bool:
+        """
+        Sleeps for up to `seconds`, returning early if an interrupt is signalled.
+        Blocks on the interrupt source's `event` when it has one, so wake-up is immediate
+        instead of depending on a polling interval. Only call this from worker threads.
+        Returns:
+            bool: True if the wait was cut short by an interrupt.
+        """
+        event = getattr(self._interrupt_source, "event", None)
+        if event is not None: return event.wait(seconds)
+        deadline = time.monotonic() + seconds
+        while not self.interrupted:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: return False
+            time.sleep(min(0.5, remaining))
+        return True
 
     @abstractmethod
-    def execute(self, arguments: dict) -> str:
+    def execute(self, arguments: dict) -> str | ToolResult:
         """
         Executes the tool with the given arguments.
         Args:
             arguments (dict): A dictionary of arguments for the tool,
                               as specified by the AI.
         Returns:
-            str: The output or result of the tool execution.
+            str | ToolResult: The output or result of the tool execution.
                  This will be fed back to the AI as an "Observation".
+                 Return a ToolResult to report a status (e.g. EXEC_INTERRUPTED) along with the output;
+                 a plain str is treated as OK unless an interrupt was signalled.
         """
         pass
 
+    def is_cacheable(self, output: str) -> bool:
+        """
+        True if a successful output may be stored in the tool cache (see cache_ttl).
+        Tools that report failures as plain text override this to keep those out of the cache.
+        """
+        return True
+
     def get_tool_info(self) -> dict:
         """
         Returns information about the tool.
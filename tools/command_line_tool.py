@@ -6,17 +6,21 @@ import time
 import queue
 import os
 
-from .base_tool import BaseTool
+from .base_tool import BaseTool, ToolResult
 import config
 import logging
 
 logger = logging.getLogger(f"{config.SERVICE_NAME}.CommandLineTool")
 
 class CommandLineTool(BaseTool):
-    def __init__(self):
+    timeout = None # Enforces DEFAULT_COMMAND_TIMEOUT itself and can hand back still-running interactive processes
+    requires_confirmation = True
+
+    def __init__(self, interrupt_source=None):
         super().__init__(
             name="command_line",
-            description="Executes a shell command on the Kali Linux system. Can be interactive."
+            description="Executes a shell command on the Kali Linux system. Can be interactive.",
+            interrupt_source=interrupt_source
         )
         self.active_process = None
         self.process_lock = threading.Lock()
@@ -28,7 +32,7 @@ class CommandLineTool(BaseTool):
         try:
             for line in iter(pipe.readline, ''):
                 if self.interrupted:
-                    logger.debug(f"Reader thread for {pipe_name} stopping due to interruption flag.")
+                    logger.debug("Reader thread for %s stopping due to interruption flag.", pipe_name)
                     break
                 q.put(line)
         except Exception as e:
@@ -38,7 +42,7 @@ class CommandLineTool(BaseTool):
                 try: pipe.close()
                 except Exception: pass # Ignore errors on close
             q.put(None) # Signal EOF
-            logger.debug(f"Reader thread for {pipe_name} finished and put None marker.")
+            logger.debug("Reader thread for %s finished and put None marker.", pipe_name)
 
     def _get_queued_output(self, clear_eof_markers=True) -> tuple[str, bool, bool]:
         output_parts = []
@@ -88,7 +92,7 @@ class CommandLineTool(BaseTool):
 
         if initial_input_str:
             try:
-                logger.info(f"Sending initial input to PID {self.active_process.pid}: {initial_input_str}")
+                logger.info("Sending initial input to PID %s: %s", self.active_process.pid, initial_input_str)
                 self.active_process.stdin.write(initial_input_str + '\n')
                 self.active_process.stdin.flush()
             except Exception as e: # Catch BrokenPipeError and others
@@ -117,14 +121,14 @@ class CommandLineTool(BaseTool):
             logger.info(f"{message_prefix} (PID: {pid}) termination sequence complete.")
 
 
-    def execute(self, arguments: dict) -> str:
+    def execute(self, arguments: dict) -> str | ToolResult:
         with self.process_lock:
             # ... (interrupt handling, terminate_interactive, stdin_input logic mostly same as previous) ...
             if self.interrupted:
                 if self.active_process and self.active_process.poll() is None:
                     self._terminate_active_process("Active process (interrupted at execute start)")
-                    return f"Command execution interrupted by user and active process terminated.\n{self._get_queued_output(clear_eof_markers=True)[0]}".strip()
-                return "Command execution interrupted by user before start."
+                    return ToolResult(ToolResult.EXEC_INTERRUPTED, f"Command execution interrupted by user and active process terminated.\n{self._get_queued_output(clear_eof_markers=True)[0]}".strip())
+                return ToolResult(ToolResult.EXEC_INTERRUPTED, "Command execution interrupted by user before start.")
 
             timeout_duration = arguments.get("timeout", config.DEFAULT_COMMAND_TIMEOUT)
             command_str = arguments.get("command")
@@ -141,7 +145,7 @@ class CommandLineTool(BaseTool):
             if stdin_input is not None:
                 if self.active_process and self.active_process.poll() is None:
                     try:
-                        logger.info(f"Sending to STDIN of PID {self.active_process.pid}: {stdin_input}")
+                        logger.info("Sending to STDIN of PID %s: %s", self.active_process.pid, stdin_input)
                         self.active_process.stdin.write(stdin_input + '\n')
                         self.active_process.stdin.flush()
                         time.sleep(0.3) 
@@ -179,7 +183,7 @@ class CommandLineTool(BaseTool):
                         self._terminate_active_process("Process (interrupted during exec loop)")
                         current_output, _, _ = self._get_queued_output(clear_eof_markers=True)
                         accumulated_output_parts.append(current_output)
-                        return f"Command interrupted.\n{''.join(accumulated_output_parts)}".strip()
+                        return ToolResult(ToolResult.EXEC_INTERRUPTED, f"Command interrupted.\n{''.join(accumulated_output_parts)}".strip())
 
                     process_status = self.active_process.poll()
                     output_chunk, _, _ = self._get_queued_output(clear_eof_markers=(process_status is not None))
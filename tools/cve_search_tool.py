@@ -1,18 +1,25 @@
 # tools/cve_search_tool.py
 from .base_tool import BaseTool
+import config
 from .web_search_tool import WebSearchTool # Uses the web search tool
 
 class CVESearchTool(BaseTool):
-    def __init__(self):
+    cache_ttl = config.CVE_SEARCH_CACHE_TTL # CVE records change rarely, so results are kept longer than web searches
+
+    def __init__(self, interrupt_source=None):
         super().__init__(
             name="cve_search",
-            description="Searches for information about Common Vulnerabilities and Exposures (CVEs)."
+            description="Searches for information about Common Vulnerabilities and Exposures (CVEs).",
+            interrupt_source=interrupt_source
         )
         # This tool will delegate to the WebSearchTool for now.
         # It could be expanded to use specific CVE APIs (e.g., NVD, Vulners)
-        self.web_search_tool = WebSearchTool()
+        self.web_search_tool = WebSearchTool(interrupt_source=interrupt_source)
         self.web_search_tool.max_results_per_engine = 2 # Fewer results for targeted CVE search
 
+    def is_cacheable(self, output: str) -> bool:
+        return not output.startswith("CVE search interrupted") and self.web_search_tool.is_cacheable(output)
+
     def execute(self, arguments: dict) -> str:
         """
         Searches for CVE information.
@@ -48,7 +55,7 @@ class CVESearchTool(BaseTool):
         self.web_search_tool.set_interrupted(self.interrupted)
         result = self.web_search_tool.execute(search_args)
         
-        if "Error:" in result and cve_id: # Fallback for specific CVE ID if targeted search fails
+        if cve_id and self.web_search_tool.is_failure(result): # Fallback for specific CVE ID if targeted search fails
              print(f"Targeted search for {cve_id} yielded an error or no results, trying broader search...")
              search_args = {"query": cve_id, "engine": "google"}
              result = self.web_search_tool.execute(search_args)
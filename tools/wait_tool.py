@@ -1,19 +1,22 @@
 # tools/wait_tool.py
 import time
-from .base_tool import BaseTool
+from .base_tool import BaseTool, ToolResult
 import logging
 import config
 
 logger = logging.getLogger(f"{config.SERVICE_NAME}.WaitTool")
 
 class WaitTool(BaseTool):
-    def __init__(self):
+    timeout = 310 # Longer than the 300 second maximum wait
+
+    def __init__(self, interrupt_source=None):
         super().__init__(
             name="wait",
-            description="Pauses execution for a specified number of seconds. Useful for waiting for background processes or before retrying an operation."
+            description="Pauses execution for a specified number of seconds. Useful for waiting for background processes or before retrying an operation.",
+            interrupt_source=interrupt_source
         )
 
-    def execute(self, arguments: dict) -> str:
+    def execute(self, arguments: dict) -> str | ToolResult:
         """
         Pauses execution.
         Args:
@@ -22,7 +25,7 @@ class WaitTool(BaseTool):
             str: A message indicating how long the tool waited.
         """
         if self.interrupted:
-            return "Wait operation interrupted by user."
+            return ToolResult(ToolResult.EXEC_INTERRUPTED, "Wait operation interrupted by user.")
 
         duration = arguments.get("duration_seconds")
         if duration is None:
@@ -38,15 +41,11 @@ class WaitTool(BaseTool):
             
             logger.info(f"Waiting for {duration_val} seconds...")
             
-            # Check for interruption periodically during the wait
-            wait_interval = 0.5 # Check for interrupt every 0.5 seconds
-            elapsed_time = 0
-            while elapsed_time < duration_val:
-                if self.interrupted:
-                    logger.info("Wait interrupted during sleep.")
-                    return f"Wait operation interrupted by user after approximately {elapsed_time:.1f} seconds."
-                time.sleep(min(wait_interval, duration_val - elapsed_time))
-                elapsed_time += wait_interval
+            start_time = time.monotonic()
+            if self.wait_interruptible(duration_val): # Wakes as soon as an interrupt is signalled
+                elapsed_time = time.monotonic() - start_time
+                logger.info("Wait interrupted during sleep.")
+                return ToolResult(ToolResult.EXEC_INTERRUPTED, f"Wait operation interrupted by user after approximately {elapsed_time:.1f} seconds.")
             
             return f"Successfully waited for {duration_val} seconds."
         except ValueError:
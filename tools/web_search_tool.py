@@ -4,13 +4,24 @@ import json
 from .base_tool import BaseTool
 import config # Import from the root directory's config.py
 
+# Output prefixes of failed or empty searches (see is_failure).
+_FAILURE_PREFIXES = ("Error", "An unexpected error", "No results found")
+# Outputs that are never served from the tool cache: failures, plus an interrupted search.
+_UNCACHEABLE_PREFIXES = _FAILURE_PREFIXES + ("Web search interrupted",)
+
 class WebSearchTool(BaseTool):
-    def __init__(self):
+    cache_ttl = config.WEB_SEARCH_CACHE_TTL
+
+    def __init__(self, interrupt_source=None):
         super().__init__(
             name="web_search",
-            description="Searches the web using Google, Tavily, or Brave Search API."
+            description="Searches the web using Google, Tavily, or Brave Search API.",
+            interrupt_source=interrupt_source
         )
         self.max_results_per_engine = 3 # Number of results to return
+        # One session per tool, so repeated searches reuse the pooled HTTPS connections to each engine
+        # instead of paying for a new TCP + TLS handshake every time.
+        self.session = requests.Session()
 
     def _google_search(self, query: str) -> str:
         if not config.GOOGLE_API_KEY or not config.GOOGLE_CSE_ID:
@@ -24,7 +35,7 @@ class WebSearchTool(BaseTool):
             "num": self.max_results_per_engine
         }
         try:
-            response = requests.get(url, params=params, timeout=10)
+            response = self.session.get(url, params=params, timeout=10)
             response.raise_for_status()
             search_results = response.json()
             
@@ -57,7 +68,7 @@ class WebSearchTool(BaseTool):
         }
         headers = {"Content-Type": "application/json"}
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=10)
+            response = self.session.post(url, json=payload, headers=headers, timeout=10)
             response.raise_for_status()
             search_results = response.json()
             
@@ -86,7 +97,7 @@ class WebSearchTool(BaseTool):
             "X-Subscription-Token": config.BRAVE_SEARCH_API_KEY
         }
         try:
-            response = requests.get(url, params=params, headers=headers, timeout=10)
+            response = self.session.get(url, params=params, headers=headers, timeout=10)
             response.raise_for_status()
             search_results = response.json()
 
@@ -113,6 +124,14 @@ class WebSearchTool(BaseTool):
         except Exception as e:
             return f"An unexpected error occurred with Brave Search: {e}"
 
+    def is_cacheable(self, output: str) -> bool:
+        return not output.startswith(_UNCACHEABLE_PREFIXES)
+
+    @staticmethod
+    def is_failure(output: str) -> bool:
+        """True if output reports a failed search or one without results."""
+        return output.startswith(_FAILURE_PREFIXES)
+
     def execute(self, arguments: dict) -> str:
         """
         Executes a web search.
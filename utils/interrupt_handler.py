@@ -1,10 +1,12 @@
 # utils/interrupt_handler.py
 import signal
 import sys
+import threading
 
 class InterruptHandler:
     def __init__(self):
-        self.interrupted = False
+        self.interrupted = False # Plain bool, cheap to read in hot loops
+        self.event = threading.Event() # Same state as an Event, so worker threads can block on it with a timeout
         self._original_sigint_handler = signal.getsignal(signal.SIGINT)
         signal.signal(signal.SIGINT, self.handle_interrupt)
 
@@ -19,12 +21,14 @@ class InterruptHandler:
             sys.exit(1)
         
         self.interrupted = True
+        self.event.set()
         print("\nInterrupt signal received. Finishing current operation or press Ctrl+C again to exit.")
         # The flag `self.interrupted` should be checked by long-running operations.
 
     def reset(self):
         """Resets the interrupted state."""
         self.interrupted = False
+        self.event.clear()
 
     def is_interrupted(self) -> bool:
         """Checks if an interrupt has been signalled."""
@@ -18,6 +18,11 @@ def setup_logging(log_file_path="logs/kali_ai_tool.log",
         log_format (str): Format string for log messages.
         service_name (str): The root logger name.
     """
+    # The log format uses no thread/process fields, so skip collecting them for every LogRecord.
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
     logger = logging.getLogger(service_name)
     logger.setLevel(logging.DEBUG)  # Set root logger to lowest level to capture all messages
 
@@ -1,4 +1,5 @@
 # utils/token_estimator.py
+import functools
 import logging
 
 # Get a logger instance for this module, prefixed by the service name if setup elsewhere
@@ -9,6 +10,30 @@ logger = logging.getLogger("KaliAIAssistant.TokenEstimator")
 # This is a very rough estimate.
 CHARS_PER_TOKEN_ESTIMATE = 4
 
+# Optional: if tiktoken is installed, its cl100k_base BPE encoding (the closest public tokenizer to
+# Claude's) is used instead of the character heuristic. The encoding is loaded on first use, since
+# tiktoken may need to download its merge table; any failure falls back to the heuristic.
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+_encoding = None
+
+def _get_encoding():
+    global _encoding, tiktoken
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"Could not load tiktoken encoding, using the character heuristic: {e}")
+            tiktoken = None
+    return _encoding
+
+@functools.lru_cache(maxsize=1024)
+def _bpe_token_count(text: str) -> int:
+    """Exact BPE token count. Cached, since encoding is the slow part and texts such as reused summaries repeat."""
+    return len(_encoding.encode(text, disallowed_special=()))
+
 def estimate_token_count(text: str) -> int:
     """
     Estimates the token count of a given text.
@@ -20,12 +45,30 @@ def estimate_token_count(text: str) -> int:
     """
     if not text:
         return 0
+    if _get_encoding() is not None:
+        return _bpe_token_count(text)
     # A simple heuristic: number of characters / average characters per token
     # Another common one is roughly num_words * 1.33
     estimated_tokens = len(text) / CHARS_PER_TOKEN_ESTIMATE
     # logger.debug(f"Estimated tokens for text (len {len(text)} chars): {int(estimated_tokens)}")
     return int(estimated_tokens)
 
+def estimate_message_token_count(message) -> int:
+    """
+    Estimates the token count of a single message object.
+    Args:
+        message (dict | Msg): A message dict with a "content" key, or an object with a `content` attribute.
+    Returns:
+        int: The estimated token count for the message.
+    """
+    content = message.get("content", "") if isinstance(message, dict) else message.content
+    if isinstance(content, str):
+        return estimate_token_count(content)
+    if isinstance(content, list): # Handle cases like Anthropic's multimodal content
+        return sum(estimate_token_count(item.get("text", "")) for item in content
+                   if isinstance(item, dict) and item.get("type") == "text")
+    return 0
+
 def estimate_messages_token_count(messages: list[dict]) -> int:
     """
     Estimates the total token count for a list of message objects.
@@ -35,15 +78,7 @@ def estimate_messages_token_count(messages: list[dict]) -> int:
     Returns:
         int: The total estimated token count for all messages.
     """
-    total_tokens = 0
-    for message in messages:
-        content = message.get("content", "")
-        if isinstance(content, str):
-            total_tokens += estimate_token_count(content)
-        elif isinstance(content, list): # Handle cases like Anthropic's multimodal content
-            for item in content:
-                if isinstance(item, dict) and item.get("type") == "text":
-                    total_tokens += estimate_token_count(item.get("text", ""))
+    total_tokens = sum(estimate_message_token_count(message) for message in messages)
     # logger.debug(f"Total estimated tokens for messages list: {total_tokens}")
     return total_tokens
 
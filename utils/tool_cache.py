@@ -0,0 +1,85 @@
+# utils/tool_cache.py
+import hashlib
+import json
+import logging
+import os
+import stat
+import threading
+import time
+
+import config
+
+logger = logging.getLogger(f"{config.SERVICE_NAME}.ToolCache")
+
+class ToolCache:
+    """
+    Results of idempotent tool calls (e.g. web and CVE searches), keyed by tool name + canonical arguments.
+    Entries live in memory and, if cache_dir is set, as one file per key in that directory, so a
+    later session reuses them too. Cached results are fed back to the AI as observations, so the
+    directory must be private: it is created with mode 0700, and an existing one is only used if it
+    belongs to the current user and grants no group/other access. Entry files are written 0600.
+    Expiry is decided at read time by the caller's max_age, like a --max-age option: stale entries
+    are simply ignored and overwritten by the next put().
+    """
+    def __init__(self, cache_dir: str = ""):
+        self._memory: dict[str, tuple[float, str]] = {} # key -> (stored_at, output)
+        self._lock = threading.Lock() # Tools run on worker threads
+        self.cache_dir = None
+        if cache_dir:
+            cache_dir = os.path.expanduser(cache_dir)
+            try:
+                os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+                problem = self._check_private_dir(cache_dir)
+            except OSError as e:
+                problem = str(e)
+            if problem is None: self.cache_dir = cache_dir
+            else: logger.warning(f"Not using tool cache directory {cache_dir}: {problem}. Caching in memory only.")
+
+    @staticmethod
+    def _check_private_dir(path: str) -> str | None:
+        """Returns why path is unsafe for cache entries (not a real directory, another owner, group/other access), or None."""
+        st = os.lstat(path)
+        if not stat.S_ISDIR(st.st_mode): return "not a directory (or a symlink)"
+        if hasattr(os, "getuid") and st.st_uid != os.getuid(): return f"owned by uid {st.st_uid}, not the current user"
+        if st.st_mode & 0o077: return f"permissions {stat.S_IMODE(st.st_mode):o} allow group/other access (expected 700)"
+        return None
+
+    @staticmethod
+    def make_key(tool_name: str, arguments: dict) -> str:
+        """sha256 of the tool name and its arguments serialized with sorted keys."""
+        canonical = json.dumps(arguments, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(f"{tool_name}\0{canonical}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.txt")
+
+    def get(self, key: str, max_age: float) -> str | None:
+        """Returns the cached output for key if it is at most max_age seconds old, else None."""
+        now = time.time()
+        with self._lock: entry = self._memory.get(key)
+        if entry is not None and now - entry[0] <= max_age: return entry[1]
+        if self.cache_dir is None: return None
+        path = self._path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if now - stored_at > max_age: return None
+            with open(path, "r", encoding="utf-8") as f: output = f.read()
+        except OSError:
+            return None # Not cached (or unreadable)
+        with self._lock: self._memory[key] = (stored_at, output)
+        return output
+
+    def put(self, key: str, output: str):
+        """Stores output for key. Disk write failures only cost the cross-session reuse."""
+        with self._lock: self._memory[key] = (time.time(), output)
+        if self.cache_dir is None: return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f: f.write(output)
+            os.replace(tmp_path, path) # Atomic, so a concurrent session never reads a partial entry
+        except OSError as e:
+            logger.warning(f"Could not write tool cache entry {path}: {e}")
+            try: os.unlink(tmp_path)
+            except OSError: pass